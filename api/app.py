@@ -1,11 +1,11 @@
+import atexit
 import datetime
+import functools
 import json
-import logging
 import os
-import threading
+import tempfile
 
 from flask import Flask, request, jsonify
-from flask import current_app
 from flask_marshmallow import Marshmallow
 from flask_sqlalchemy import SQLAlchemy
 from log_datasets.datasets import NovaDataset, HDFSDataset, BGLDataset
@@ -13,18 +13,34 @@ from log_datasets.datasets import NovaDataset, HDFSDataset, BGLDataset
 from pyvis.network import Network
 from utils.graphs_util import create_networkx_graph, nx2pyvis
 
+import experiment_worker
+from dataset_registry import DatasetRegistry, DatasetState
+from result_cache import ResultCache
+from result_store import ResultStore
+from scheduler import JobScheduler, JobState, QueueFullError
+
 app = Flask(__name__)
 
-# necessary datasets from logs2graph library
-nova_dataset = NovaDataset(data_folder_path="./data")
-nova_dataset.initialize_dataset()
-app.datasets = {
-    'NOVA': nova_dataset
+# necessary datasets from logs2graph library, loaded on first use
+# the loaded datasets are unloaded when their memory exceeds DATASETS_MEMORY_BUDGET bytes (if set)
+memory_budget = os.environ.get('DATASETS_MEMORY_BUDGET')
+memory_budget = int(memory_budget) if memory_budget else None
+dataset_factories = {
+    'NOVA': functools.partial(NovaDataset, data_folder_path="./data"),
+    'HDFS': functools.partial(HDFSDataset, data_folder_path="./data"),
+    'BGL': functools.partial(BGLDataset, data_folder_path="./data")
 }
+app.datasets = DatasetRegistry(dataset_factories, memory_budget=memory_budget)
 
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'db.sqlite') + '?check_same_thread=False'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    'DATABASE_URI', 'sqlite:///' + os.path.join(basedir, 'db.sqlite') + '?check_same_thread=False')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# the number of processes that run the experiments and the maximum number of experiments waiting for them
+app.config['EXPERIMENT_WORKERS'] = int(os.environ.get('EXPERIMENT_WORKERS', 2))
+app.config['EXPERIMENT_QUEUE_DEPTH'] = int(os.environ.get('EXPERIMENT_QUEUE_DEPTH', 100))
+# the maximum size in bytes of the cached results of the experiments
+app.config['RESULT_CACHE_MAX_BYTES'] = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 10 * 2 ** 30))
 # Initialize the DB
 db = SQLAlchemy(app)
 # Initialize ma
@@ -43,6 +59,8 @@ class Experiment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.datetime.now())
     last_modified_at = db.Column(db.DateTime, default=datetime.datetime.now())
     status = db.Column(db.String, default='CREATED')
+    # the reason of the failure of a FAILED experiment
+    error = db.Column(db.String, nullable=True)
     test_id = db.Column(db.Integer, nullable=True)
 
     def __init__(self, name, dataset, window_type, size, slide, test_id, include_last_event):
@@ -61,55 +79,48 @@ class ExperimentSchema(ma.Schema):
     class Meta:
         fields = (
             'id', 'name', 'dataset', 'window_type', 'size', 'slide', 'include_last_event', 'test_id', 'created_at',
-            'last_modified_at', 'status'
+            'last_modified_at', 'status', 'error'
         )
 
 
 experiment_schema = ExperimentSchema()
 experiments_schema = ExperimentSchema(many=True)
 
-def run_experiment(experiment: Experiment):
+def get_results_path(experiment_id) -> str:
+    return f'./experiments/{experiment_id}.sqlite'
+
+
+def update_experiment_status(experiment_id, state, error=None):
+    """
+    Function called by the scheduler whenever the state of the job of an experiment changes
+    """
+    result_key = result_keys.pop(experiment_id, None) if state not in (JobState.QUEUED, JobState.RUNNING) else None
+    if state == JobState.SUCCESS and result_key is not None:
+        result_cache.put(result_key, get_results_path(experiment_id))
     with app.app_context():
-        # print (app.datasets)
-        # print (current_app.datasets)
-        logging.info("Thread for experiment ID %d for dataset %s: starting", experiment.id, experiment.dataset)
-        result = current_app.datasets.get(experiment.dataset.upper()).create_graphs(window_type=experiment.window_type,
-                                                                                    window_size=experiment.size,
-                                                                                    window_slide=experiment.slide,
-                                                                                    test_id=experiment.test_id,
-                                                                                    include_last=experiment.include_last_event)
-
-        logging.info("Thread for experiment for dataset %s: is done. Starting to save results!", experiment.dataset)
-
-        experiment_id = experiment.id
-        os.mkdir(f'./experiments/{experiment_id}')
-
-        main_results_file = open(f'./experiments/{experiment_id}/results.json', 'w')
-        json.dump(result, main_results_file)
-        main_results_file.close()
-
-        for item in result:
-            start = item.get('start', None)
-            end = item.get('end', None)
-            session_id = item.get('session_id', None)
-            graph_dict = item.get("graph_dict", dict())
-
-            if len(graph_dict) != 0:
-                subdirectory_name = f'{start}___{end}' if session_id is None else session_id
-                os.mkdir(f'./experiments/{experiment_id}/{subdirectory_name}')
-                graph_dict_file = open(f'./experiments/{experiment_id}/{subdirectory_name}/graph.json', 'w')
-                json.dump(graph_dict, graph_dict_file)
-                graph_dict_file.close()
-
-        logging.info("Thread for experiment for dataset %s: is done. Results are saved", experiment.dataset)
-
-        # update in the database that the experiment is completed!
         experiment = Experiment.query.get(experiment_id)
-        experiment.status = 'SUCCESS'
+        if experiment is None:
+            # the experiment was deleted
+            return
+        experiment.status = state
+        experiment.error = error
         experiment.last_modified_at = datetime.datetime.now()
         db.session.commit()
 
 
+result_cache = ResultCache('./experiments_cache', app.config['RESULT_CACHE_MAX_BYTES'])
+# the result cache keys of the experiments whose job is not finished
+result_keys = {}
+
+scheduler = JobScheduler(workers=app.config['EXPERIMENT_WORKERS'],
+                         max_queue_depth=app.config['EXPERIMENT_QUEUE_DEPTH'],
+                         on_state_change=update_experiment_status,
+                         initializer=experiment_worker.initialize,
+                         initargs=(dataset_factories, memory_budget),
+                         preload=['experiment_worker'])
+atexit.register(scheduler.shutdown)
+
+
 @app.route('/experiment/create', methods=['POST'])
 def create_experiment():
     input_json = request.get_json(force=True)
@@ -120,8 +131,22 @@ def create_experiment():
     slide = input_json['slide']
     test_id = input_json.get("testId", None)
     include_last_event = input_json.get('includeLastEvent', False)
+    priority = input_json.get('priority', 0)
     # include_last_event = input_json.get(   Or['includeLastEvent']
 
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        return jsonify({"error_message": "The priority should be an integer!"})
+
+    if dataset.upper() not in app.datasets.names():
+        return jsonify({"error_message": f"Unknown dataset {dataset}!"})
+    # the experiments are accepted only when their dataset is loaded, the first request starts the loading
+    if app.datasets.request(dataset) != DatasetState.READY:
+        response = jsonify({"error_message": f"The dataset {dataset} is being loaded, please try again when it is "
+                                             f"ready!"})
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        response.headers.add('Retry-After', '10')
+        return response, 503
+
     # check if there is already a same experiment like this one
     experiment_already_exists = db.session.query(Experiment).filter(
         Experiment.dataset == dataset, Experiment.window_type == window_type, Experiment.size == size,
@@ -136,18 +161,65 @@ def create_experiment():
         return response
 
     new_experiment = Experiment(name, dataset, window_type, size, slide, test_id, include_last_event)
+    new_experiment.status = JobState.QUEUED
 
     db.session.add(new_experiment)
     db.session.commit()
 
-    thread = threading.Thread(target=run_experiment, args=(new_experiment,))
-    thread.start()
+    # the results of an equivalent experiment are taken from the cache
+    fingerprint = app.datasets.fingerprint(dataset)
+    result_key = None
+    if fingerprint is not None:
+        result_key = ResultCache.experiment_key(fingerprint, window_type, size, slide, test_id, include_last_event,
+                                                app.datasets.get(dataset).has_test_ids())
+        if result_cache.get(result_key, get_results_path(new_experiment.id)):
+            new_experiment.status = JobState.SUCCESS
+            new_experiment.last_modified_at = datetime.datetime.now()
+            db.session.commit()
+            response = experiment_schema.jsonify(new_experiment)
+            response.headers.add('Access-Control-Allow-Origin', '*')
+            return response
+        result_keys[new_experiment.id] = result_key
+
+    parameters = {'window_type': window_type, 'window_size': size, 'window_slide': slide, 'test_id': test_id,
+                  'include_last': include_last_event}
+    try:
+        scheduler.submit(new_experiment.id, experiment_worker.run_experiment,
+                         (dataset, parameters, new_experiment.id, get_results_path(new_experiment.id)), priority)
+    except QueueFullError:
+        result_keys.pop(new_experiment.id, None)
+        db.session.delete(new_experiment)
+        db.session.commit()
+        response = jsonify({"error_message": "Too many experiments are waiting to be computed, please try again "
+                                             "later!"})
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        response.headers.add('Retry-After', '60')
+        return response, 503
 
     response = experiment_schema.jsonify(new_experiment)
     response.headers.add('Access-Control-Allow-Origin', '*')
     return response
 
 
+@app.route('/datasets', methods=['GET'])
+def get_datasets():
+    response = jsonify(app.datasets.status())
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
+
+@app.route('/dataset/ready', methods=['GET'])
+def get_dataset_readiness():
+    # starts loading the dataset if it is not loaded yet
+    dataset = request.args.get('dataset', default="", type=str)
+    if dataset.upper() not in app.datasets.names():
+        return jsonify({"error_message": f"Unknown dataset {dataset}!"})
+    state = app.datasets.request(dataset)
+    response = jsonify({"dataset": dataset.upper(), "state": state, "ready": state == DatasetState.READY})
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
+
 @app.route('/experiments', methods=['GET'])
 def get_experiments():
     all_experiments = Experiment.query.all()
@@ -160,11 +232,20 @@ def get_experiments():
 @app.route("/experiments/delete", methods=['DELETE'])
 def delete_experiment():
     id = request.args.get('experimentId', type=int)
+    scheduler.cancel(id)
     Experiment.query.filter_by(id=id).delete()
     db.session.commit()
     return jsonify("All good!")
 
 
+@app.route('/experiment/cancel', methods=['POST'])
+def cancel_experiment():
+    id = request.args.get('experimentId', type=int)
+    if not scheduler.cancel(id):
+        return jsonify({"error_message": "The experiment is not queued or running!"})
+    return jsonify("All good!")
+
+
 @app.route('/experiment/windows', methods=['GET'])
 def get_windows_list():
     experiment_id = request.args.get('experimentId', default=1, type=int)
@@ -172,17 +253,11 @@ def get_windows_list():
     window_type = experiment.window_type
     if not experiment.status.startswith('SUCCESS'):
         return jsonify({"error_message": "The experiment is not done yet, or it failed. Check logs!"})
-    list_of_windows = []
-    for folder in os.listdir(f'./experiments/{experiment_id}'):
-        if folder != 'results.json':
-            list_of_windows.append(folder)
-    dataset_file = open(f'./experiments/{experiment_id}/results.json')
-    dataset_content = "".join(dataset_file.readlines())
-    dataset_file.close()
+    results = ResultStore(get_results_path(experiment_id))
     return jsonify({
-        "windows": list_of_windows,
+        "windows": results.get_windows(),
         "type": "session" if window_type == "session" else "time",
-        "dataset": dataset_content
+        "dataset": results.get_results_json()
     })
 
 
@@ -191,16 +266,18 @@ def get_window_graph_data():
     # input_json = request.get_json(force=True)
     experiment_id = request.args.get('experimentId', default=1, type=int)
     window = request.args.get('window', default="", type=str)
-    file = open(f'./experiments/{experiment_id}/{window}/graph.json')
-    graph_data = file.read()
-    file.close()
-    graph_dict = json.loads(graph_data)
+    graph_dict = ResultStore(get_results_path(experiment_id)).get_graph_dict(window)
+    if graph_dict is None:
+        return jsonify({"error_message": "The window does not exist!"})
+    graph_data = json.dumps(graph_dict)
     nx_graph = create_networkx_graph(graph_dict)
     nt = nx2pyvis(nx_graph, Network("900px", "100%", bgcolor='#222222', font_color='white'), 15, 0)
     nt.repulsion(node_distance=500, spring_length=300)
-    nt.show(f'./experiments/{experiment_id}/{window}/vis.html')
-    file = open(f'./experiments/{experiment_id}/{window}/vis.html', 'r')
-    content = "".join(file.readlines())
+    with tempfile.TemporaryDirectory() as folder:
+        # show would render the page for a notebook (pyvis >= 0.3) or open it in a browser on the server (pyvis < 0.3)
+        nt.write_html(os.path.join(folder, 'vis.html'))
+        with open(os.path.join(folder, 'vis.html'), 'r') as file:
+            content = file.read()
     return jsonify({
         "graph_dict": graph_data,
         "html_content": content
@@ -0,0 +1,172 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class DatasetState:
+    UNLOADED = 'UNLOADED'
+    LOADING = 'LOADING'
+    READY = 'READY'
+    FAILED = 'FAILED'
+
+
+class DatasetEntry:
+    def __init__(self, factory):
+        self.factory = factory
+        self.state = DatasetState.UNLOADED
+        self.dataset = None
+        self.memory = 0
+        self.last_used = 0.0
+        self.users = 0
+        self.error = None
+
+
+class DatasetRegistry:
+    """
+    Class that loads the datasets of the API on demand. A dataset is loaded in a background thread when it is first
+    requested (see request), or synchronously by get/use. The loaded logs come from the Feather cache of the dataset,
+    which is memory-mapped, so the processes that load the same dataset share its pages instead of each holding a copy.
+    When the memory of the loaded datasets exceeds the budget, the least recently used datasets that are not in use are
+    unloaded (they are loaded again from the cache on the next use).
+    """
+
+    def __init__(self, factories, memory_budget: int = None):
+        """
+        :param factories: dictionary from the name of every dataset to a function that creates the (uninitialized)
+        dataset
+        :param memory_budget: the maximum memory in bytes of the loaded datasets, None for no limit
+        """
+        self.entries = {name: DatasetEntry(factory) for name, factory in factories.items()}
+        self.memory_budget = memory_budget
+        self.condition = threading.Condition()
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def after_fork(self):
+        # the loading threads of the parent do not exist in the child process
+        self.condition = threading.Condition()
+        for entry in self.entries.values():
+            entry.users = 0
+            if entry.state == DatasetState.LOADING:
+                entry.state = DatasetState.UNLOADED
+
+    def names(self):
+        return list(self.entries.keys())
+
+    def get_entry(self, name) -> DatasetEntry:
+        entry = self.entries.get(name.upper())
+        if entry is None:
+            raise KeyError(f"Unknown dataset {name}")
+        return entry
+
+    def fingerprint(self, name):
+        """
+        :return: the key of the content of the source files and the parser settings of the dataset (see
+        Dataset.get_source_key), None if some source file does not exist yet
+        """
+        entry = self.get_entry(name)
+        dataset = entry.dataset if entry.dataset is not None else entry.factory()
+        source_files = dataset.get_source_files()
+        if len(source_files) == 0 or not all(os.path.exists(path) for path in source_files):
+            return None
+        return dataset.get_source_key()
+
+    def status(self) -> dict:
+        """
+        :return: dictionary with the state and the memory in bytes of every dataset
+        """
+        with self.condition:
+            return {name: {'state': entry.state, 'memory': entry.memory, 'error': entry.error}
+                    for name, entry in self.entries.items()}
+
+    def request(self, name) -> str:
+        """
+        Method that starts loading the dataset in a background thread, if it is not loaded or loading yet
+        :return: the state of the dataset
+        """
+        entry = self.get_entry(name)
+        with self.condition:
+            if entry.state in (DatasetState.UNLOADED, DatasetState.FAILED):
+                entry.state = DatasetState.LOADING
+                entry.error = None
+                threading.Thread(target=self.load, args=(name.upper(),), name=f'load-{name}', daemon=True).start()
+            return entry.state
+
+    def get(self, name):
+        """
+        Method that returns the dataset, loading it in the current thread if needed (or waiting for the background
+        thread that is loading it)
+        """
+        entry = self.get_entry(name)
+        with self.condition:
+            while entry.state == DatasetState.LOADING:
+                self.condition.wait()
+            if entry.state == DatasetState.READY:
+                entry.last_used = time.monotonic()
+                return entry.dataset
+            entry.state = DatasetState.LOADING
+        self.load(name.upper())
+        with self.condition:
+            if entry.state != DatasetState.READY:
+                raise RuntimeError(f"The dataset {name} could not be loaded: {entry.error}")
+            return entry.dataset
+
+    @contextmanager
+    def use(self, name):
+        """
+        Context manager that returns the dataset (see get) and protects it from eviction while it is in use
+        """
+        entry = self.get_entry(name)
+        with self.condition:
+            entry.users += 1
+        try:
+            yield self.get(name)
+        finally:
+            with self.condition:
+                entry.users -= 1
+                entry.last_used = time.monotonic()
+
+    def load(self, name):
+        entry = self.entries[name]
+        logging.info("Loading dataset %s", name)
+        try:
+            dataset = entry.factory()
+            dataset.initialize_dataset()
+            memory = int(dataset.logs.memory_usage(deep=True).sum())
+        except Exception as e:
+            logging.exception("Could not load dataset %s", name)
+            with self.condition:
+                entry.state = DatasetState.FAILED
+                entry.error = str(e)
+                self.condition.notify_all()
+            return
+        with self.condition:
+            entry.dataset = dataset
+            entry.memory = memory
+            entry.state = DatasetState.READY
+            entry.last_used = time.monotonic()
+            self.evict(keep=name)
+            self.condition.notify_all()
+        logging.info("Dataset %s is loaded (%d bytes)", name, memory)
+
+    def evict(self, keep=None):
+        """
+        Method that unloads the least recently used datasets that are not in use until the memory of the loaded
+        datasets fits the budget. Should be called with the condition acquired.
+        :param keep: the name of a dataset that should not be unloaded
+        """
+        if self.memory_budget is None:
+            return
+        loaded = [(entry.last_used, name) for name, entry in self.entries.items()
+                  if entry.state == DatasetState.READY and name != keep and entry.users == 0]
+        total = sum(entry.memory for entry in self.entries.values() if entry.state == DatasetState.READY)
+        for _, name in sorted(loaded):
+            if total <= self.memory_budget:
+                break
+            entry = self.entries[name]
+            logging.info("Unloading dataset %s (%d bytes)", name, entry.memory)
+            total -= entry.memory
+            entry.dataset = None
+            entry.memory = 0
+            entry.state = DatasetState.UNLOADED
@@ -0,0 +1,30 @@
+import logging
+
+from dataset_registry import DatasetRegistry
+from result_store import ResultStore
+
+# the datasets of the worker process, created by initialize
+datasets = None
+
+
+def initialize(factories, memory_budget=None):
+    """
+    Function called by the scheduler when a worker process starts. The worker loads a dataset on its first experiment
+    for it, from the memory-mapped Feather cache written by the server, so the pages of the logs are shared with the
+    server and the other workers.
+    :param factories: see DatasetRegistry
+    :param memory_budget: see DatasetRegistry
+    """
+    global datasets
+    datasets = DatasetRegistry(factories, memory_budget)
+
+
+def run_experiment(dataset, parameters, experiment_id, results_path, cancel_event):
+    """
+    Function that computes the graphs of an experiment, in a worker process of the scheduler, and writes them to a
+    ResultStore. The generation stops between two batches of windows when the experiment is cancelled.
+    """
+    logging.info("Job for experiment ID %d for dataset %s: starting", experiment_id, dataset)
+    with datasets.use(dataset) as log_dataset:
+        ResultStore(results_path).write(log_dataset.iter_graphs(**parameters), cancel_event)
+    logging.info("Job for experiment for dataset %s: is done. Results are saved", dataset)
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+# Increase when the generation of the graphs or the format of the stored results changes, so that the results cached
+# by a previous version are not served anymore
+RESULT_VERSION = 1
+
+
+class ResultCache:
+    """
+    Content-addressed cache of the results of the experiments. The results are stored in the folder of the cache under
+    a key computed from the fingerprint of the dataset and the canonical parameters of the experiment (see
+    experiment_key), so that an experiment equivalent to an already computed one (even if deleted, or created for a
+    dataset reloaded from identical files) is served by linking the cached result file (see ResultStore). The least
+    recently used results are evicted when the total size of the cache exceeds max_bytes.
+    """
+
+    def __init__(self, folder: str, max_bytes: int):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(folder, 'index.json')
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+    @staticmethod
+    def experiment_key(fingerprint: str, window_type: str, size, slide, test_id, include_last,
+                       has_test_ids: bool = True) -> str:
+        """
+        :param fingerprint: the fingerprint of the content of the dataset, see Dataset.get_source_key
+        :param has_test_ids: whether the dataset has test ids, see Dataset.has_test_ids
+        :return: key of the results of the experiment. A tumbling window is a sliding window with slide == size, the
+        size and the slide are not used by session windows and the test_id is not used by the datasets without test
+        ids, so equivalent experiments have the same key.
+        """
+        if not has_test_ids:
+            test_id = None
+        if window_type == 'tumbling':
+            window_type, slide = 'sliding', size
+        if window_type == 'session':
+            size, slide = None, None
+        description = {
+            'version': RESULT_VERSION,
+            'fingerprint': fingerprint,
+            'window_type': window_type,
+            'size': size,
+            'slide': slide,
+            'test_id': test_id,
+            'include_last': bool(include_last)
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, key: str, destination: str) -> bool:
+        """
+        Method that places the cached results of the key in the destination file (which should not exist)
+        :return: whether the results were in the cache
+        """
+        with self.lock:
+            if key not in self.index or not os.path.isfile(self.entry_path(key)):
+                return False
+            self.index[key]['last_used'] = time.time()
+            self.save_index()
+            link_file(self.entry_path(key), destination)
+            return True
+
+    def put(self, key: str, source: str):
+        """
+        Method that adds the results in the source file to the cache, evicting the least recently used results if
+        the cache becomes too large
+        """
+        with self.lock:
+            if key in self.index:
+                return
+            tmp_path = f'{self.entry_path(key)}.{os.getpid()}.tmp'
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            link_file(source, tmp_path)
+            os.replace(tmp_path, self.entry_path(key))
+            self.index[key] = {'bytes': os.path.getsize(self.entry_path(key)), 'last_used': time.time()}
+            self.evict()
+            self.save_index()
+
+    def total_bytes(self) -> int:
+        return sum(entry['bytes'] for entry in self.index.values())
+
+    def evict(self):
+        total = self.total_bytes()
+        for key in sorted(self.index, key=lambda k: self.index[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= self.index[key]['bytes']
+            if os.path.exists(self.entry_path(key)):
+                os.remove(self.entry_path(key))
+            del self.index[key]
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.folder, key)
+
+    def save_index(self):
+        tmp_path = f'{self.index_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+
+def link_file(source: str, destination: str):
+    """
+    Method that copies a file with a hard link when possible (the results are never modified after they are written),
+    falling back to a real copy across file systems
+    """
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
@@ -0,0 +1,152 @@
+import json
+import os
+import sqlite3
+
+from scheduler import JobCancelled
+
+SCHEMA = """
+CREATE TABLE windows (
+    position INTEGER PRIMARY KEY,
+    window TEXT NOT NULL,
+    start TEXT,
+    end TEXT,
+    session_id,
+    edges INTEGER NOT NULL
+);
+CREATE TABLE edges (
+    position INTEGER NOT NULL,
+    source,
+    target,
+    weight
+);
+"""
+
+INDEXES = """
+CREATE INDEX windows_window ON windows (window);
+CREATE INDEX edges_position ON edges (position);
+"""
+
+
+class ResultStore:
+    """
+    Single-file store of the results of an experiment: an SQLite database with one row per window (in the order of
+    generation) and one row per edge of the graph of every window, with indexes on the window key and on the window of
+    the edges. It replaces the folder with one results.json and one folder with a graph.json per window, so a window is
+    read without listing or opening thousands of files. The database is written to a temporary file, which is moved to
+    its path once complete.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @staticmethod
+    def get_window_key(item: dict) -> str:
+        """
+        :param item: a result of GraphCreator.iter_graphs
+        :return: the key of the window of the result, as shown to the clients of the API
+        """
+        session_id = item.get('session_id', None)
+        return f"{item.get('start', None)}___{item.get('end', None)}" if session_id is None else str(session_id)
+
+    def write(self, items, cancel_event=None, batch_size: int = 1000):
+        """
+        Method that writes the results of an experiment as they are generated
+        :param items: iterable of the results of GraphCreator.iter_graphs (with the graphs as dictionaries)
+        :param cancel_event: the writing stops with JobCancelled when this event is set. It is checked once per batch,
+        since checking the event of a multiprocessing.Manager is a round trip to the manager process
+        :param batch_size: the number of windows inserted at once
+        """
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = sqlite3.connect(tmp_path)
+        try:
+            # the temporary file is thrown away on failure, so there is no need for a journal
+            connection.execute('PRAGMA journal_mode = OFF')
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.executescript(SCHEMA)
+            windows, edges = [], []
+            for position, item in enumerate(items):
+                if position % batch_size == 0 and cancel_event is not None and cancel_event.is_set():
+                    raise JobCancelled(f"Writing of {self.path} was cancelled")
+                graph_dict = item.get('graph_dict', dict())
+                count = len(edges)
+                for source, targets in graph_dict.items():
+                    edges.extend((position, source, target, weight) for target, weight in targets.items())
+                windows.append((position, self.get_window_key(item), item.get('start', None), item.get('end', None),
+                                item.get('session_id', None), len(edges) - count))
+                if len(windows) >= batch_size:
+                    self.insert(connection, windows, edges)
+                    windows, edges = [], []
+            self.insert(connection, windows, edges)
+            connection.executescript(INDEXES)
+            connection.commit()
+        except BaseException:
+            connection.close()
+            os.remove(tmp_path)
+            raise
+        connection.close()
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def insert(connection, windows: list, edges: list):
+        connection.executemany('INSERT INTO windows VALUES (?, ?, ?, ?, ?, ?)', windows)
+        connection.executemany('INSERT INTO edges VALUES (?, ?, ?, ?)', edges)
+
+    def connect(self):
+        return sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+
+    def get_windows(self) -> list:
+        """
+        :return: the keys of the windows with a non-empty graph, in the order of generation
+        """
+        connection = self.connect()
+        try:
+            return [row[0] for row in connection.execute(
+                'SELECT window FROM windows WHERE edges > 0 ORDER BY position')]
+        finally:
+            connection.close()
+
+    def get_graph_dict(self, window: str):
+        """
+        :return: the dictionary representation of the graph of the window, None if there is no such window
+        """
+        connection = self.connect()
+        try:
+            row = connection.execute('SELECT position FROM windows WHERE window = ? ORDER BY position LIMIT 1',
+                                     (window,)).fetchone()
+            if row is None:
+                return None
+            return self.read_graph_dict(connection.execute(
+                'SELECT source, target, weight FROM edges WHERE position = ? ORDER BY rowid', row))
+        finally:
+            connection.close()
+
+    def get_results_json(self) -> str:
+        """
+        :return: the results of the experiment as the JSON list written by the former results.json
+        """
+        connection = self.connect()
+        try:
+            edges = connection.execute('SELECT position, source, target, weight FROM edges ORDER BY position, rowid')
+            edge = next(edges, None)
+            parts = []
+            for position, _, start, end, session_id, count in connection.execute(
+                    'SELECT * FROM windows ORDER BY position'):
+                item = {'start': start, 'end': end} if session_id is None else {'session_id': session_id}
+                window_edges = []
+                for _ in range(count):
+                    window_edges.append(edge[1:])
+                    edge = next(edges, None)
+                item['graph_dict'] = self.read_graph_dict(window_edges)
+                parts.append(json.dumps(item))
+            return '[' + ', '.join(parts) + ']'
+        finally:
+            connection.close()
+
+    @staticmethod
+    def read_graph_dict(edges) -> dict:
+        graph_dict = {}
+        for source, target, weight in edges:
+            graph_dict.setdefault(source, {})[target] = weight
+        return graph_dict
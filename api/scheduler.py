@@ -0,0 +1,237 @@
+import heapq
+import itertools
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class JobState:
+    QUEUED = 'QUEUED'
+    RUNNING = 'RUNNING'
+    SUCCESS = 'SUCCESS'
+    FAILED = 'FAILED'
+    CANCELLED = 'CANCELLED'
+
+
+class QueueFullError(Exception):
+    """
+    Raised by JobScheduler.submit when the queue already holds the maximum number of waiting jobs
+    """
+    pass
+
+
+class JobCancelled(Exception):
+    """
+    Raised by a job function that stops because its cancel event was set
+    """
+    pass
+
+
+class Job:
+    def __init__(self, job_id, function, args, priority: int, cancel_event):
+        self.job_id = job_id
+        self.function = function
+        self.args = args
+        self.priority = priority
+        self.cancel_event = cancel_event
+        self.state = JobState.QUEUED
+        self.future = None
+        self.executor = None
+
+
+class JobScheduler:
+    """
+    Class that runs jobs in a pool of worker processes. The workers are started by a fork server (or spawned where
+    there is no fork server), never forked from the server itself: the server runs several threads, and a forked child
+    could inherit a lock held by one of them (e.g. of sqlite3) and block forever. The jobs wait in a queue ordered by
+    priority (and then by submission) with a maximum depth, and at most `workers` jobs run at the same time. A job is
+    QUEUED when submit returns, and every later change of its state is reported with on_state_change (QUEUED is not
+    reported, since the dispatcher could report RUNNING before it).
+    A job function is called as function(*args, cancel_event) in a worker process, and it should check
+    cancel_event.is_set() regularly and raise JobCancelled when it is set.
+    If a worker process dies (e.g. killed by the OOM killer), the jobs running in the pool fail and the pool is replaced
+    by a new one, so that the next jobs still run.
+    """
+
+    def __init__(self, workers: int = 2, max_queue_depth: int = 100, on_state_change=None, initializer=None,
+                 initargs=(), preload=()):
+        """
+        :param workers: the number of worker processes
+        :param max_queue_depth: the maximum number of jobs waiting in the queue
+        :param on_state_change: function called as on_state_change(job_id, state, error) in a thread of the scheduler
+        whenever a job becomes RUNNING, SUCCESS, FAILED or CANCELLED, error is the message of the exception of a FAILED
+        job and None otherwise
+        :param initializer: module level function called as initializer(*initargs) when a worker process starts
+        :param initargs: the arguments of the initializer, they should be picklable
+        :param preload: the names of the modules imported once by the fork server, so that the workers do not import
+        them again (e.g. the module of the job functions)
+        """
+        self.workers = workers
+        self.max_queue_depth = max_queue_depth
+        self.on_state_change = on_state_change
+        self.queue = []
+        self.jobs = {}
+        self.running = 0
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.initializer = initializer
+        self.initargs = initargs
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self.context = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver':
+            self.context.set_forkserver_preload(list(preload))
+        self.manager = None
+        self.executor = None
+        self.dispatcher = None
+        self.closed = False
+
+    def start(self):
+        """
+        Method that starts the worker processes and the thread that dispatches the queued jobs to them. It is called by
+        the first submit.
+        """
+        self.manager = self.context.Manager()
+        self.executor = self.create_executor()
+        self.dispatcher = threading.Thread(target=self.dispatch, name='job-dispatcher', daemon=True)
+        self.dispatcher.start()
+
+    def create_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=self.context, initializer=self.initializer,
+                                   initargs=self.initargs)
+
+    def replace_executor(self, broken: ProcessPoolExecutor):
+        """
+        Method that replaces the pool of worker processes after one of them died, unless it was already replaced
+        :param broken: the pool in which the worker process died
+        """
+        with self.condition:
+            if self.closed or self.executor is not broken:
+                return
+            logging.error("A worker process died, starting new worker processes")
+            self.executor = self.create_executor()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, job_id, function, args=(), priority: int = 0):
+        """
+        Method that adds a job to the queue
+        :param job_id: unique id of the job, reported to on_state_change
+        :param function: module level function, called as function(*args, cancel_event) in a worker process
+        :param args: the arguments of the function, they should be picklable
+        :param priority: the jobs with higher priority run first
+        :raise QueueFullError: if the queue already holds max_queue_depth jobs
+        """
+        if not isinstance(priority, int) or isinstance(priority, bool):
+            raise TypeError(f"The priority should be an integer, got {priority!r}")
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("The scheduler is shut down")
+            if len(self.queue) >= self.max_queue_depth:
+                raise QueueFullError(f"The queue already holds {len(self.queue)} jobs")
+            if self.executor is None:
+                self.start()
+            job = Job(job_id, function, args, priority, self.manager.Event())
+            self.jobs[job_id] = job
+            heapq.heappush(self.queue, (-priority, next(self.counter), job))
+            self.condition.notify_all()
+
+    def cancel(self, job_id) -> bool:
+        """
+        Method that cancels a job. A queued job is removed from the queue, a running job is asked to stop with its
+        cancel event and becomes CANCELLED when its function raises JobCancelled.
+        :return: whether the job was queued or running
+        """
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            job.cancel_event.set()
+            if job.state != JobState.QUEUED:
+                return True
+            self.queue = [entry for entry in self.queue if entry[2] is not job]
+            heapq.heapify(self.queue)
+            del self.jobs[job_id]
+        self.report(job_id, JobState.CANCELLED)
+        return True
+
+    def get_state(self, job_id):
+        """
+        :return: the state of a queued or running job, None for the other jobs
+        """
+        with self.condition:
+            job = self.jobs.get(job_id)
+            return job.state if job is not None else None
+
+    def queue_depth(self) -> int:
+        with self.condition:
+            return len(self.queue)
+
+    def dispatch(self):
+        while True:
+            with self.condition:
+                while not self.closed and (not self.queue or self.running >= self.workers):
+                    self.condition.wait()
+                if self.closed:
+                    return
+                job = heapq.heappop(self.queue)[2]
+                job.state = JobState.RUNNING
+                job.executor = self.executor
+                self.running += 1
+            self.report(job.job_id, JobState.RUNNING)
+            try:
+                try:
+                    job.future = job.executor.submit(job.function, *job.args, job.cancel_event)
+                except BrokenProcessPool:
+                    # a worker process died after the previous dispatch, the job is retried with new workers
+                    self.replace_executor(job.executor)
+                    with self.condition:
+                        job.executor = self.executor
+                    job.future = job.executor.submit(job.function, *job.args, job.cancel_event)
+            except Exception as e:
+                logging.exception("Could not start job %s", job.job_id)
+                self.finish_job(job, JobState.FAILED, f"Could not start the job: {e}")
+                continue
+            job.future.add_done_callback(lambda future, job=job: self.finish(job, future))
+
+    def finish(self, job: Job, future):
+        error = None
+        exception = future.exception() if not future.cancelled() else None
+        if future.cancelled() or isinstance(exception, JobCancelled):
+            state = JobState.CANCELLED
+        elif exception is not None:
+            state = JobState.FAILED
+            error = str(exception) or type(exception).__name__
+            logging.error("Job %s failed: %s", job.job_id, error)
+            if isinstance(exception, BrokenProcessPool):
+                self.replace_executor(job.executor)
+        else:
+            state = JobState.SUCCESS
+        self.finish_job(job, state, error)
+
+    def finish_job(self, job: Job, state, error=None):
+        with self.condition:
+            self.running -= 1
+            self.jobs.pop(job.job_id, None)
+            self.condition.notify_all()
+        self.report(job.job_id, state, error)
+
+    def report(self, job_id, state, error=None):
+        if self.on_state_change is not None:
+            try:
+                self.on_state_change(job_id, state, error)
+            except Exception:
+                logging.exception("Could not report the state %s of job %s", state, job_id)
+
+    def shutdown(self):
+        """
+        Method that cancels the queued and running jobs and stops the workers
+        """
+        with self.condition:
+            self.closed = True
+            for job in self.jobs.values():
+                job.cancel_event.set()
+            self.condition.notify_all()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.manager.shutdown()
@@ -0,0 +1,10 @@
+import os
+import sys
+
+API_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LIBRARY_FOLDER = os.path.join(os.path.dirname(API_FOLDER), 'core-library', 'src')
+
+# the API imports its modules and the library (when it is not installed) from these folders
+for folder in (LIBRARY_FOLDER, API_FOLDER):
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
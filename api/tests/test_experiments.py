@@ -0,0 +1,113 @@
+import importlib
+import json
+import os
+import time
+
+import pytest
+
+TIMEOUT = 120
+
+
+def write_nova_logs(folder):
+    """
+    Method that writes a small NOVA dataset: two tests with a few events every second for ten minutes
+    """
+    os.makedirs(os.path.join(folder, 'nova'))
+    with open(os.path.join(folder, 'nova', 'logs.csv'), 'w') as f:
+        f.write('test_id,time_hour,EventId\n')
+        for second in range(600):
+            for test_id, event_id in ((1, 'a1'), (1, 'b2' if second % 3 else 'c3'), (2, 'a1')):
+                f.write(f'{test_id},2022-01-01 00:{second // 60:02d}:{second % 60:02d},{event_id}\n')
+    with open(os.path.join(folder, 'nova', 'event_templates.csv'), 'w') as f:
+        f.write('EventId,EventTemplate\n')
+
+
+def wait_for(condition, message):
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.2)
+    pytest.fail(message)
+
+
+@pytest.fixture(scope='module')
+def api(tmp_path_factory):
+    # the API works with the data and the experiments in the current folder
+    folder = tmp_path_factory.mktemp('api')
+    write_nova_logs(str(folder / 'data'))
+    os.makedirs(folder / 'experiments')
+    previous_folder = os.getcwd()
+    os.chdir(folder)
+    os.environ['DATABASE_URI'] = f"sqlite:///{folder / 'db.sqlite'}?check_same_thread=False"
+    os.environ['EXPERIMENT_WORKERS'] = '1'
+    try:
+        app_module = importlib.import_module('app')
+        with app_module.app.app_context():
+            app_module.db.create_all()
+        yield app_module
+        app_module.scheduler.shutdown()
+    finally:
+        os.chdir(previous_folder)
+        del os.environ['DATABASE_URI']
+        del os.environ['EXPERIMENT_WORKERS']
+
+
+def create_experiment(client, **parameters):
+    body = {'name': 'sliding', 'dataset': 'NOVA', 'windowType': 'sliding', 'size': 60000, 'slide': 60000,
+            'testId': 1, **parameters}
+
+    def create():
+        # the API answers 503 until the dataset is loaded
+        response = client.post('/experiment/create', json=body)
+        return response.get_json() if response.status_code == 200 else None
+
+    return wait_for(create, "The dataset was not loaded")
+
+
+def wait_until_done(client, experiment_id) -> str:
+    def finished_status():
+        status = next(experiment['status'] for experiment in client.get('/experiments').get_json()
+                      if experiment['id'] == experiment_id)
+        return status if status not in ('QUEUED', 'RUNNING') else None
+
+    return wait_for(finished_status, "The experiment did not finish")
+
+
+def test_experiment_runs_in_a_worker_and_is_served_from_the_result_store(api):
+    client = api.app.test_client()
+    experiment = create_experiment(client)
+    assert experiment['status'] == 'QUEUED'
+
+    assert wait_until_done(client, experiment['id']) == 'SUCCESS'
+
+    windows = client.get('/experiment/windows', query_string={'experimentId': experiment['id']}).get_json()
+    assert windows['type'] == 'time'
+    assert len(windows['windows']) == 10
+
+    # the worker computed the same graphs as the library in the server
+    graphs = api.app.datasets.get('NOVA').iter_graphs(window_type='sliding', window_size=60000, window_slide=60000,
+                                                      test_id=1, include_last=False)
+    expected = {api.ResultStore.get_window_key(item): item['graph_dict'] for item in graphs}
+    for window in windows['windows']:
+        graph = client.get('/experiment/window', query_string={'experimentId': experiment['id'], 'window': window})
+        assert graph.status_code == 200
+        assert json.loads(graph.get_json()['graph_dict']) == expected[window]
+
+
+def test_equivalent_experiment_is_served_from_the_result_cache(api):
+    client = api.app.test_client()
+    experiment = create_experiment(client, name='tumbling', windowType='tumbling', slide=None)
+    assert experiment['status'] == 'SUCCESS'
+    windows = client.get('/experiment/windows', query_string={'experimentId': experiment['id']}).get_json()
+    assert len(windows['windows']) == 10
+
+
+def test_result_cache_key_ignores_the_unused_parameters(api):
+    key = api.ResultCache.experiment_key
+    assert key('f', 'tumbling', 1000, None, 1, False) == key('f', 'sliding', 1000, 1000, 1, False)
+    assert key('f', 'session', 1000, 10, 1, False) == key('f', 'session', None, None, 1, False)
+    assert key('f', 'session', None, None, 1, False) != key('f', 'session', None, None, 2, False)
+    assert key('f', 'session', None, None, 1, False, has_test_ids=False) == \
+        key('f', 'session', None, None, None, False, has_test_ids=False)
@@ -1,9 +1,14 @@
 import datetime
 from abc import abstractmethod, ABC
-from typing import Mapping, Union, List
+from os import makedirs
+from os.path import exists
+from typing import Mapping, Union, List, Iterator
 
+import numpy as np
 import pandas as pd
 
+from utils.cache_utils import cache_key, read_cached_frame, write_cached_frame
+from utils.event_vocabulary import EventVocabulary
 from utils.graphs_util import create_graph_as_dict
 from utils.window_utils import generate_time_windows, generate_session_windows
 from utils.graphs_util import GraphCreator, GraphFromTimeWindowCreator, GraphFromSessionWindowCreator, \
@@ -18,12 +23,22 @@ class Dataset(ABC):
     - session_id (probably only possible in the HDFS dataset)
     - test_id (probably applicable only for the NOVA dataset)
     - event_id (string)
+    After the loading, the logs are converted to a compact schema (see compact_logs): the event ids and the session ids
+    are categorical, and the categories of the event ids are the vocabulary of the dataset stored in self.vocabulary,
+    so the graphs are created directly from the codes of the categories.
+    The logs with a test_id are sorted by test_id and timestamp, and self.test_partitions maps every test_id to the
+    bounds of the contiguous slice of its logs.
+    The normalized logs are cached in a Feather file in the cache folder of the data folder, keyed by the checksums of
+    the source files and the parser settings of the dataset, so that the later initializations only memory-map that file.
     """
 
-    def __init__(self, data_folder_path="../data"):
+    def __init__(self, data_folder_path="../data", use_cache=True):
         self.logs = pd.DataFrame()
         self.templates = pd.DataFrame()
+        self.vocabulary = None
+        self.test_partitions = {}
         self.data_folder_path = data_folder_path
+        self.use_cache = use_cache
 
     @abstractmethod
     def load_logs(self):
@@ -51,45 +66,191 @@ class Dataset(ABC):
         """
         pass
 
+    def get_source_files(self) -> List[str]:
+        """
+        :return: the paths of the files from which the logs are computed. The cached logs are used only while the
+        content of these files does not change. A dataset without source files is never cached.
+        """
+        return []
+
+    def get_parser_settings(self) -> dict:
+        """
+        :return: json serializable dictionary with the settings used to compute the logs from the source files
+        """
+        return {}
+
+    def get_cache_path(self):
+        """
+        :return: the path of the cached logs for the current source files and parser settings, or None if some of the
+        source files do not exist yet
+        """
+        source_files = self.get_source_files()
+        if len(source_files) == 0 or not all(exists(path) for path in source_files):
+            return None
+        return f'{self.get_cache_folder()}/{type(self).__name__}-{self.get_source_key()[:16]}.feather'
+
+    def get_cache_folder(self) -> str:
+        cache_folder = f'{self.data_folder_path}/cache'
+        if not exists(cache_folder):
+            makedirs(cache_folder)
+        return cache_folder
+
+    def get_source_key(self) -> str:
+        """
+        :return: key that changes whenever the content of a source file or a parser setting changes, see cache_key
+        """
+        return cache_key(type(self).__name__, self.get_source_files(), self.get_parser_settings(),
+                         f'{self.get_cache_folder()}/checksums.json')
+
+    def get_parser_key(self) -> str:
+        """
+        :return: key of the output of the parser (e.g. the structured logs of DRAIN), that changes whenever the content
+        of a source file or a parser setting changes, but not with the format of the cached frames (CACHE_VERSION)
+        """
+        return cache_key(type(self).__name__, self.get_source_files(), self.get_parser_settings(),
+                         f'{self.get_cache_folder()}/checksums.json', version=None)
+
     def initialize_dataset(self):
-        self.load_logs()
-        self.load_event_templates()
-        self.assign_event_id_to_logs()
+        cache_path = self.get_cache_path() if self.use_cache else None
+        if cache_path is not None and exists(cache_path):
+            self.logs = read_cached_frame(cache_path)
+            self.load_event_templates()
+        else:
+            self.load_logs()
+            self.load_event_templates()
+            self.assign_event_id_to_logs()
+            self.compact_logs()
+            self.sort_by_test_id()
+            cache_path = self.get_cache_path() if self.use_cache else None
+            if cache_path is not None:
+                write_cached_frame(self.logs, cache_path)
+        self.encode_event_ids()
+        self.build_test_partitions()
+
+    def compact_logs(self):
+        """
+        Method that converts the columns of the logs to compact types: categorical event_id and session_id (with the
+        categories in order of first occurrence), the smallest integer type that fits the test ids and datetime64
+        timestamps
+        :return: void
+        """
+        for column in ['event_id', 'session_id']:
+            if column in self.logs.columns and not isinstance(self.logs[column].dtype, pd.CategoricalDtype):
+                codes, categories = pd.factorize(self.logs[column])
+                self.logs[column] = pd.Categorical.from_codes(codes, categories)
+        if 'test_id' in self.logs.columns:
+            self.logs['test_id'] = pd.to_numeric(self.logs['test_id'], downcast='integer')
+        if 'timestamp' in self.logs.columns:
+            self.logs['timestamp'] = pd.to_datetime(self.logs['timestamp'])
+
+    def sort_by_test_id(self):
+        """
+        Method that sorts the logs by test_id and then by timestamp (keeping the order of the logs with the same
+        timestamp), so that the logs of every test are a contiguous slice sorted by time
+        :return: void
+        """
+        if 'test_id' in self.logs.columns:
+            self.logs = self.logs.sort_values(['test_id', 'timestamp'], kind='mergesort', ignore_index=True)
+
+    def build_test_partitions(self):
+        """
+        Method that builds the partition index of the logs sorted by sort_by_test_id, which maps every test_id to the
+        bounds (start, stop) of the slice of its logs
+        :return: void
+        """
+        self.test_partitions = {}
+        if 'test_id' not in self.logs.columns:
+            return
+        test_ids = self.logs['test_id'].to_numpy()
+        starts = np.concatenate([[0], np.flatnonzero(test_ids[1:] != test_ids[:-1]) + 1])
+        stops = np.append(starts[1:], len(test_ids))
+        for start, stop in zip(starts, stops):
+            self.test_partitions[test_ids[start].item()] = (int(start), int(stop))
+
+    def has_test_ids(self) -> bool:
+        """
+        :return: whether the logs have a test_id, the test_id of the graphs is ignored otherwise
+        """
+        return 'test_id' in self.logs.columns
+
+    def get_test_logs(self, test_id) -> pd.DataFrame:
+        """
+        :return: the logs of the test, as a slice of the logs (without scanning or copying the logs), or all the logs
+        if the dataset has no test ids
+        """
+        if not self.has_test_ids():
+            return self.logs
+        start, stop = self.test_partitions.get(test_id, (0, 0))
+        return self.logs.iloc[start:stop]
 
-    def create_graphs(self, window_type, window_size, window_slide, test_id, include_last=True) \
+    def encode_event_ids(self):
+        """
+        Method that builds the vocabulary of the event ids from the categories of the event_id column
+        :return: void
+        """
+        self.vocabulary = EventVocabulary.from_categorical(self.logs['event_id'])
+
+    def create_graphs(self, window_type, window_size, window_slide, test_id, include_last=True, as_dict=True,
+                      workers=1) \
             -> List[Mapping[str, Union[datetime.datetime, Mapping[str, Mapping[str, int]]]]]:
-        # TODO add support for session windows as well
         """
         :param window_type: string that represents the window type, possible values are: session, tumbling, sliding
         :param window_size: the size of the window in milliseconds
         :param window_slide: the size of the slide of the window in milliseconds
         :param test_id: an integer that represent the test_id of a experiment. applicable only for the nova dataset
         :param include_last: A bool value that represents whether the last event ID should be included in the graph generation
+        :param as_dict: if False, the graphs are returned as TransitionGraph objects under the key `graph`, instead of
+        the dictionary representation under the key `graph_dict`
+        :param workers: the number of processes used for the generation of the graphs. The result is the same for any
+        number of workers
         :return: result: list of dictionaries where each dictionary represents the data for one graph created by this
         method. Each dictionary has three key,value pairs. The first two (str,datetime.datetime) represent the start
         and the end of the window for which the graph was generated and the third one `graph_dic` represents the dictionary
         representation of the graph as obtained from the create_graph_as_dict method.
         """
-        logs = self.logs[self.logs['test_id'] == test_id] if 'test_id' in self.logs.columns else self.logs
+        return self.get_graph_creator(window_type, window_size, window_slide, test_id, include_last,
+                                      as_dict, workers).create_graphs()
+
+    def iter_graphs(self, window_type, window_size, window_slide, test_id, include_last=True, as_dict=True,
+                    workers=1) \
+            -> Iterator[Mapping[str, Union[datetime.datetime, Mapping[str, Mapping[str, int]]]]]:
+        """
+        Streaming version of create_graphs that yields the dictionary of one window/session at a time instead of
+        materializing the whole list. The parameters are the same as in create_graphs.
+        """
+        return self.get_graph_creator(window_type, window_size, window_slide, test_id, include_last,
+                                      as_dict, workers).iter_graphs()
+
+    def get_graph_creator(self, window_type, window_size, window_slide, test_id, include_last=True, as_dict=True,
+                          workers=1) \
+            -> GraphCreator:
+        logs = self.get_test_logs(test_id)
         if window_type == 'session' and "session_id" not in self.logs.columns:
             raise Exception("Session windows are not allowed for this dataset")
 
         if window_type == 'tumbling':
-            graph_creator = GraphFromTumblingWindowCreator(
+            return GraphFromTumblingWindowCreator(
                 logs=logs,
                 include_last=include_last,
-                window_size=window_size)
+                window_size=window_size,
+                vocabulary=self.vocabulary,
+                as_dict=as_dict,
+                workers=workers)
         elif window_type == 'sliding':
-            graph_creator = GraphFromSlidingWindowCreator(
+            return GraphFromSlidingWindowCreator(
                 logs=logs,
                 include_last=include_last,
                 window_size=window_size,
-                window_slide=window_slide
+                window_slide=window_slide,
+                vocabulary=self.vocabulary,
+                as_dict=as_dict,
+                workers=workers
             )
         else:
-            graph_creator = GraphFromSessionWindowCreator(
+            return GraphFromSessionWindowCreator(
                 logs=logs,
-                include_last=include_last
+                include_last=include_last,
+                vocabulary=self.vocabulary,
+                as_dict=as_dict,
+                workers=workers
             )
-
-        return graph_creator.create_graphs()
\ No newline at end of file
@@ -1,26 +1,28 @@
-import datetime
-import re
-from os import mkdir, makedirs
+from os import mkdir, makedirs, remove
 from os.path import exists, join
 
 import gdown
 import pandas as pd
 
 from log_datasets.dataset import Dataset
-from utils.Drain import LogParser
+from utils.cache_utils import is_artifact_current, mark_artifact_current
+from utils.Drain import LogParser, find_in_parameters
+from utils.timestamp_utils import parse_fixed_width, parse_hdfs_timestamps
 
 
 class HDFSDataset(Dataset):
-    def __init__(self, data_folder_path="../data"):
-        Dataset.__init__(self, data_folder_path)
-
-    @staticmethod
-    def __find(params):
-        for x in eval(params):
-            if "blk" in x:
-                match = re.search('(.*)(blk_(-*\d*))(.*)', x)
-                return match.group(2)
-        return None
+    log_format = "<Date> <Time> <Pid> <Level> <Component>: <Content>"
+    # Regular expression list for optional preprocessing (default: [])
+    regex = [
+        r'blk_(|-)[0-9]+',  # block id
+        r'(/|)([0-9]+\.){3}[0-9]+(:[0-9]+|)(:|)',  # IP
+        r'(?<=[^A-Za-z0-9])(\-?\+?\d+)(?=[^A-Za-z0-9])|[0-9]+$',  # Numbers
+    ]
+    st = 0.5  # Similarity threshold
+    depth = 2  # Depth of all leaf nodes
+
+    def __init__(self, data_folder_path="../data", use_cache=True):
+        Dataset.__init__(self, data_folder_path, use_cache)
 
     def load_logs(self):
 
@@ -32,40 +34,39 @@ class HDFSDataset(Dataset):
             mkdir(join(f"{self.data_folder_path}/hdfs"))
             gdown.download(url, output_path, quiet=False)
 
-        if not exists(f"{self.data_folder_path}/hdfs/HDFS.log_structured.csv"):
+        # Parse the logs with DRAIN, unless the structured logs of the same raw logs and settings already exist
+        structured_file = f"{self.data_folder_path}/hdfs/HDFS.log_structured.csv"
+        parser_key = self.get_parser_key()
+        if not is_artifact_current(structured_file, parser_key):
             input_dir = f"{self.data_folder_path}/hdfs/"
             output_dir = f"{self.data_folder_path}/hdfs/"
             log_file = 'HDFS.log'
-            log_format = "<Date> <Time> <Pid> <Level> <Component>: <Content>"
-
-            # Regular expression list for optional preprocessing (default: [])
-            regex = [
-                r'blk_(|-)[0-9]+',  # block id
-                r'(/|)([0-9]+\.){3}[0-9]+(:[0-9]+|)(:|)',  # IP
-                r'(?<=[^A-Za-z0-9])(\-?\+?\d+)(?=[^A-Za-z0-9])|[0-9]+$',  # Numbers
-            ]
-            st = 0.5  # Similarity threshold
-            depth = 2  # Depth of all leaf nodes
-
-            parser = LogParser(log_format, indir=input_dir, outdir=output_dir, depth=depth, st=st, rex=regex)
+
+            # the block ids are extracted with find_in_parameters, so the parameter lists are not needed
+            parser = LogParser(self.log_format, indir=input_dir, outdir=output_dir, depth=self.depth, st=self.st,
+                               rex=self.regex, keep_para=False)
             parser.parse(log_file)
+            mark_artifact_current(structured_file, parser_key)
 
-        self.logs = pd.read_csv(f"{self.data_folder_path}/hdfs/HDFS.log_structured.csv")
+        self.logs = pd.read_csv(structured_file,
+                                usecols=['Date', 'Time', 'Content', 'EventId', 'EventTemplate'])
         self.logs = self.logs.iloc[1:, :]
-        dates = {81109: "2008-11-9", 81110: "2008-11-10", 81111: "2008-11-11"}
-        self.logs['Date'] = self.logs['Date'].apply(lambda x: dates[x])
-        self.logs['Time'] = self.logs['Time'].apply(
-            lambda x: datetime.datetime.strptime(str(x).zfill(6), "%H%M%S").strftime("%H:%M:%S"))
-        self.logs['timestamp'] = pd.to_datetime(self.logs['Date'] + " " + self.logs['Time'])
+        self.logs['timestamp'] = parse_hdfs_timestamps(self.logs['Date'], self.logs['Time'])
         self.logs['EventId'] = self.logs['EventId'].astype('str')
-        self.logs['block_id'] = self.logs['ParameterList'].apply(lambda x: self.__find(x))
-        self.logs['block_id'] = self.logs['block_id'].astype('str')
+        self.logs['block_id'] = find_in_parameters(self.logs['EventTemplate'], self.logs['Content'], r'blk_-*\d*')
+        self.logs['block_id'] = self.logs['block_id'].fillna('None')
         self.logs.sort_values(['timestamp'], inplace=True)
 
         self.logs = self.logs[['timestamp', 'EventId', 'block_id']]
         self.logs.rename(columns={'timestamp': 'timestamp', 'EventId': 'event_id', 'block_id': 'session_id'},
                          inplace=True)
 
+    def get_source_files(self):
+        return [f"{self.data_folder_path}/hdfs/HDFS.log"]
+
+    def get_parser_settings(self):
+        return {'log_format': self.log_format, 'regex': self.regex, 'st': self.st, 'depth': self.depth}
+
     def load_event_templates(self):
         output_path = f'{self.data_folder_path}/hdfs/HDFS.log_templates.csv'
         self.templates = pd.read_csv(output_path)
@@ -82,8 +83,13 @@ class HDFSDataset(Dataset):
 
 
 class BGLDataset(Dataset):
-    def __init__(self, data_folder_path="../data"):
-        Dataset.__init__(self, data_folder_path)
+    log_format = "<Label> <Timestamp> <Date> <Node> <Time> <NodeRepeat> <Type> <Component> <Level> <Content>"
+    # Replace the commas with semicolons while DRAIN reads the lines
+    # commas cause problems with DRAIN and writing to csv
+    replacements = [(',', ';')]
+
+    def __init__(self, data_folder_path="../data", use_cache=True):
+        Dataset.__init__(self, data_folder_path, use_cache)
 
     def load_logs(self):
         output_file = f'{self.data_folder_path}/bgl/unparsed/logs.log'
@@ -96,29 +102,26 @@ class BGLDataset(Dataset):
             makedirs(f'{self.data_folder_path}/bgl/unparsed')
             gdown.download(url, output_file, quiet=False)
 
-        # Replace the commas with semicolons
-        # commas cause problems with DRAIN and writing to csv
-        log_file = f'{self.data_folder_path}/bgl/unparsed/processed_logs.log'
-
-        lf = open(log_file, 'a')
-
-        with open(output_file) as of:
-            for line in of:
-                lf.write(line.replace(',', ';'))
-
-        lf.close()
-
-        # Parse the logs with DRAIN
-        log_file = 'processed_logs.log'
+        # Parse the logs with DRAIN, unless the structured logs of the same raw logs and settings already exist
+        log_file = 'logs.log'
         input_dir = f'{self.data_folder_path}/bgl/unparsed/'
         output_dir = f'{self.data_folder_path}/bgl/'
-        log_format = "<Label> <Timestamp> <Date> <Node> <Time> <NodeRepeat> <Type> <Component> <Level> <Content>"
+        structured_file = f'{output_dir}{log_file}_structured.csv'
+
+        parser_key = self.get_parser_key()
+        if not is_artifact_current(structured_file, parser_key):
+            parser = LogParser(self.log_format, indir=input_dir, outdir=output_dir, replacements=self.replacements)
+            parser.parse(log_file)
+            mark_artifact_current(structured_file, parser_key)
 
-        parser = LogParser(log_format, indir=input_dir, outdir=output_dir)
-        parser.parse(log_file)
+        # the files of the former preprocessing, which wrote a copy of the raw logs without commas, are not used anymore
+        for old_file in (f'{input_dir}processed_logs.log', f'{output_dir}processed_logs.log_structured.csv',
+                         f'{output_dir}processed_logs.log_templates.csv'):
+            if exists(old_file):
+                remove(old_file)
 
-        self.logs = pd.read_csv(output_dir + 'processed_logs.log_structured.csv')
-        self.logs['Time'] = pd.to_datetime(self.logs['Time'], format='%Y-%m-%d-%H.%M.%S.%f')
+        self.logs = pd.read_csv(structured_file, usecols=['Time', 'EventId'])
+        self.logs['Time'] = parse_fixed_width(self.logs['Time'], 'YYYY-mm-dd-HH.MM.SS.ffffff', '%Y-%m-%d-%H.%M.%S.%f')
         self.logs.sort_values(['Time'])
 
         self.logs = self.logs[['Time', 'EventId']]
@@ -126,6 +129,12 @@ class BGLDataset(Dataset):
         print(self.logs.head())
         print(len(self.logs))
 
+    def get_source_files(self):
+        return [f'{self.data_folder_path}/bgl/unparsed/logs.log']
+
+    def get_parser_settings(self):
+        return {'log_format': self.log_format, 'replacements': self.replacements}
+
     def load_event_templates(self):
         """
         Drain has already extracted the event templates, do nothing.
@@ -140,8 +149,8 @@ class BGLDataset(Dataset):
 
 
 class NovaDataset(Dataset):
-    def __init__(self, data_folder_path="../data"):
-        Dataset.__init__(self, data_folder_path)
+    def __init__(self, data_folder_path="../data", use_cache=True):
+        Dataset.__init__(self, data_folder_path, use_cache)
 
     def load_logs(self):
         output_path = f'{self.data_folder_path}/nova/logs.csv'
@@ -153,7 +162,7 @@ class NovaDataset(Dataset):
         self.logs = pd.read_csv(output_path)
         self.logs = self.logs.iloc[1:, :]
         self.logs['test_id'] = self.logs['test_id'].astype('int')
-        self.logs['time_hour'] = pd.to_datetime(self.logs['time_hour'])
+        self.logs['time_hour'] = parse_fixed_width(self.logs['time_hour'], 'YYYY-mm-dd HH:MM:SS')
         self.logs.sort_values(['time_hour'])
 
         self.logs = self.logs[['test_id', 'time_hour', 'EventId']]
@@ -161,6 +170,9 @@ class NovaDataset(Dataset):
         print(self.logs.head())
         print(len(self.logs))
 
+    def get_source_files(self):
+        return [f'{self.data_folder_path}/nova/logs.csv']
+
     def load_event_templates(self):
         output_path = f'{self.data_folder_path}/nova/event_templates.csv'
         url = 'https://drive.google.com/uc?id=1SZqgSvUhvwZTofKslo21U3z2VEBbU17w'
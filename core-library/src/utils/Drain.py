@@ -5,22 +5,39 @@ License     : MIT
 """
 
 import regex as re
+import io
+import json
+import locale
 import os
+import pickle
 import numpy as np
 import pandas as pd
 import hashlib
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import lru_cache
+
+# The maximum number of compiled template regular expressions kept by compile_template_regex
+TEMPLATE_CACHE_SIZE = 4096
+# The number of log lines masked at once by LogParser.clusterLogs
+MASKING_BATCH_SIZE = 1000
+# The default number of preprocessed log messages kept by the repeat cache of LogParser
+REPEAT_CACHE_SIZE = 10000
 
 
 class Logcluster:
-    def __init__(self, logTemplate='', logIDL=None):
+    # the log lines of the clusters are not stored in the clusters, see LogParser.clusterLogs
+    __slots__ = ('logTemplate', 'clusterId')
+
+    def __init__(self, logTemplate='', clusterId=None):
         self.logTemplate = logTemplate
-        if logIDL is None:
-            logIDL = []
-        self.logIDL = logIDL
+        self.clusterId = clusterId
 
 
 class Node:
+    __slots__ = ('childD', 'depth', 'digitOrtoken')
+
     def __init__(self, childD=None, depth=0, digitOrtoken=None):
         if childD is None:
             childD = dict()
@@ -29,13 +46,150 @@ class Node:
         self.digitOrtoken = digitOrtoken
 
 
+class ClusterLeaf:
+    """ Leaf of the prefix tree, with the clusters of the leaf and an inverted index from the (position, token) pairs
+    of the constant tokens of their templates to the clusters. All templates of a leaf have the same length, so the
+    similarity of seqDist is proportional to the number of postings of a message that point to a cluster.
+    """
+
+    def __init__(self):
+        self.clusters = []
+        self.postings = {}
+        self.numPars = []
+        self.positions = {}
+        # increased whenever a cluster is added or generalized, see RepeatCache
+        self.version = 0
+
+    def __len__(self):
+        return len(self.clusters)
+
+    def __iter__(self):
+        return iter(self.clusters)
+
+    def add(self, logClust):
+        index = len(self.clusters)
+        self.positions[id(logClust)] = index
+        self.clusters.append(logClust)
+        self.numPars.append(0)
+        self.version += 1
+        for position, token in enumerate(logClust.logTemplate):
+            if token == '<*>':
+                self.numPars[index] += 1
+            else:
+                self.postings.setdefault((position, token), set()).add(index)
+
+    def updateTemplate(self, logClust, newTemplate):
+        """ Function that replaces the template of a cluster of the leaf with a more general one (i.e. with some
+        constant tokens replaced by <*>), updating the index
+        """
+        index = self.positions[id(logClust)]
+        for position, (oldToken, newToken) in enumerate(zip(logClust.logTemplate, newTemplate)):
+            if oldToken != newToken:
+                self.postings[(position, oldToken)].discard(index)
+                self.numPars[index] += 1
+        logClust.logTemplate = newTemplate
+        self.version += 1
+
+    def match(self, seq):
+        """
+        :return: tuple (cluster, number of similar tokens) with the cluster that would be chosen by a linear scan
+        with seqDist in fastMatch: the most similar template, then the one with most parameters, then the first one
+        """
+        counts = Counter()
+        for position, token in enumerate(seq):
+            indexes = self.postings.get((position, token))
+            if indexes:
+                counts.update(indexes)
+        if counts:
+            numPars = self.numPars
+            index = max(counts, key=lambda i: (counts[i], numPars[i], -i))
+            return self.clusters[index], counts[index]
+        # no template shares a constant token with the message
+        index = max(range(len(self.clusters)), key=lambda i: (self.numPars[i], -i))
+        return self.clusters[index], 0
+
+
+class RepeatCache:
+    """ LRU cache from preprocessed log messages to their clusters, so that the exact repeats of a message skip the
+    tree search. An entry is valid as long as the leaf of its cluster (see ClusterLeaf.version) and the nodes of the
+    prefix tree do not change, since clustering the message again would then give the same cluster and leave its
+    template unchanged.
+    """
+
+    def __init__(self, size=REPEAT_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, line, treeVersion):
+        entry = self.entries.get(line)
+        if entry is not None:
+            logClust, leaf, leafVersion, entryTreeVersion = entry
+            if leaf.version == leafVersion and entryTreeVersion == treeVersion:
+                self.entries.move_to_end(line)
+                self.hits += 1
+                return logClust
+            del self.entries[line]
+        self.misses += 1
+        return None
+
+    def put(self, line, logClust, leaf, treeVersion):
+        if self.size <= 0:
+            return
+        self.entries[line] = (logClust, leaf, leaf.version, treeVersion)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """
+        :return: dictionary with the number of hits and misses, the hit rate and the number of cached messages
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self.entries)}
+
+
+class MaskingEngine:
+    """ Engine that applies the preprocessing regular expressions of Drain, replacing every match with <*>, in the
+    order of the expressions. The expressions are compiled only once.
+    The expressions are not fused in a single alternation: a substitution changes the text seen by the next expressions
+    (e.g. '<*>' next to the match of a previous expression), so a single pass does not give the same output in general.
+    """
+
+    def __init__(self, rex):
+        self.patterns = [re.compile(currentRex) for currentRex in rex]
+
+    def mask(self, line):
+        for pattern in self.patterns:
+            line = pattern.sub('<*>', line)
+        return line
+
+    def mask_batch(self, lines):
+        """ Function that masks a batch of lines, with the lookup of the compiled expressions done once per batch
+        """
+        lines = list(lines)
+        for pattern in self.patterns:
+            sub = pattern.sub
+            lines = [sub('<*>', line) for line in lines]
+        return lines
+
+
 class LogParser:
     def __init__(self, log_format, indir='./', outdir='./result/', depth=4, st=0.4, 
-                 maxChild=100, rex=[], keep_para=True):
+                 maxChild=100, rex=[], keep_para=True, repeat_cache_size=REPEAT_CACHE_SIZE,
+                 replacements=None):
         """
         Attributes
         ----------
             rex : regular expressions used in preprocessing (step1)
+            repeat_cache_size : max number of preprocessed log messages in the repeat cache (0 to disable it)
+            replacements : list of (old, new) string pairs replaced in every raw line while it is read
             path : the input path stores the input log file name
             depth : depth of all leaf nodes
             st : similarity threshold
@@ -53,12 +207,24 @@ class LogParser:
         self.log_format = log_format
         self.rex = rex
         self.keep_para = keep_para
+        self.masking = MaskingEngine(rex)
+        self.repeat_cache_size = repeat_cache_size
+        self.replacements = replacements or []
+        self.repeatCache = RepeatCache(repeat_cache_size)
+        # increased whenever a node is added to a prefix tree, see RepeatCache
+        self.treeVersion = 0
 
     def hasNumbers(self, s):
         return any(char.isdigit() for char in s)
 
     def treeSearch(self, rn, seq):
-        retLogClust = None
+        return self.fastMatch(self.leafSearch(rn, seq), seq)
+
+    def leafSearch(self, rn, seq):
+        """ Function that returns the clusters of the leaf of the prefix tree where seq belongs (an empty collection
+        if there is no such leaf)
+        """
+        retLogClust = ()
 
         seqLen = len(seq)
         if seqLen not in rn.childD:
@@ -79,17 +245,14 @@ class LogParser:
                 return retLogClust
             currentDepth += 1
 
-        logClustL = parentn.childD
-
-        retLogClust = self.fastMatch(logClustL, seq)
-
-        return retLogClust
+        return parentn.childD
 
     def addSeqToPrefixTree(self, rn, logClust):
         seqLen = len(logClust.logTemplate)
         if seqLen not in rn.childD:
             firtLayerNode = Node(depth=1, digitOrtoken=seqLen)
             rn.childD[seqLen] = firtLayerNode
+            self.treeVersion += 1
         else:
             firtLayerNode = rn.childD[seqLen]
 
@@ -100,10 +263,9 @@ class LogParser:
 
             #Add current log cluster to the leaf node
             if currentDepth >= self.depth or currentDepth > seqLen:
-                if len(parentn.childD) == 0:
-                    parentn.childD = [logClust]
-                else:
-                    parentn.childD.append(logClust)
+                if not isinstance(parentn.childD, ClusterLeaf):
+                    parentn.childD = ClusterLeaf()
+                parentn.childD.add(logClust)
                 break
 
             #If token not matched in this layer of existing tree. 
@@ -114,6 +276,7 @@ class LogParser:
                             newNode = Node(depth=currentDepth + 1, digitOrtoken=token)
                             parentn.childD[token] = newNode
                             parentn = newNode
+                            self.treeVersion += 1
                         else:
                             parentn = parentn.childD['<*>']
                     else:
@@ -121,10 +284,12 @@ class LogParser:
                             newNode = Node(depth=currentDepth+1, digitOrtoken=token)
                             parentn.childD[token] = newNode
                             parentn = newNode
+                            self.treeVersion += 1
                         elif len(parentn.childD)+1 == self.maxChild:
                             newNode = Node(depth=currentDepth+1, digitOrtoken='<*>')
                             parentn.childD['<*>'] = newNode
                             parentn = newNode
+                            self.treeVersion += 1
                         else:
                             parentn = parentn.childD['<*>']
             
@@ -133,6 +298,7 @@ class LogParser:
                         newNode = Node(depth=currentDepth+1, digitOrtoken='<*>')
                         parentn.childD['<*>'] = newNode
                         parentn = newNode
+                        self.treeVersion += 1
                     else:
                         parentn = parentn.childD['<*>']
 
@@ -163,6 +329,14 @@ class LogParser:
     def fastMatch(self, logClustL, seq):
         retLogClust = None
 
+        if isinstance(logClustL, ClusterLeaf):
+            # same result as the linear scan below, comparing only the clusters with common tokens
+            if len(logClustL) > 0:
+                maxClust, simTokens = logClustL.match(seq)
+                if float(simTokens) / len(seq) >= self.st:
+                    retLogClust = maxClust
+            return retLogClust
+
         maxSim = -1
         maxNumOfPara = -1
         maxClust = None
@@ -194,26 +368,19 @@ class LogParser:
 
         return retVal
 
-    def outputResult(self, logClustL):
-        log_templates = [0] * self.df_log.shape[0]
-        log_templateids = [0] * self.df_log.shape[0]
-        df_events = []
-        for logClust in logClustL:
-            template_str = ' '.join(logClust.logTemplate)
-            occurrence = len(logClust.logIDL)
-            template_id = hashlib.md5(template_str.encode('utf-8')).hexdigest()[0:8]
-            for logID in logClust.logIDL:
-                logID -= 1
-                log_templates[logID] = template_str
-                log_templateids[logID] = template_id
-            df_events.append([template_id, template_str, occurrence])
-
-        df_event = pd.DataFrame(df_events, columns=['EventId', 'EventTemplate', 'Occurrences'])
-        self.df_log['EventId'] = log_templateids
-        self.df_log['EventTemplate'] = log_templates
+    def outputResult(self, logClustL, assignments):
+        """
+        :param assignments: array with the index of the cluster of every row of self.df_log, see clusterLogs
+        """
+        log_templates = np.array([' '.join(logClust.logTemplate) for logClust in logClustL], dtype=object)
+        log_templateids = np.array([hashlib.md5(template_str.encode('utf-8')).hexdigest()[0:8]
+                                    for template_str in log_templates], dtype=object)
+
+        self.df_log['EventId'] = log_templateids[assignments]
+        self.df_log['EventTemplate'] = log_templates[assignments]
 
         if self.keep_para:
-            self.df_log["ParameterList"] = self.df_log.apply(self.get_parameter_list, axis=1) 
+            self.df_log["ParameterList"] = extract_parameter_lists(self.df_log['EventTemplate'], self.df_log['Content'])
         self.df_log.to_csv(os.path.join(self.savePath, self.logName + '_structured.csv'), escapechar='\\', index=False)
 
 
@@ -249,72 +416,291 @@ class LogParser:
         print('Parsing file: ' + os.path.join(self.path, logName))
         start_time = datetime.now()
         self.logName = logName
-        rootNode = Node()
-        logCluL = []
 
         self.load_data()
 
-        count = 0
-        for idx, line in self.df_log.iterrows():
-            logID = line['LineId']
-            logmessageL = self.preprocess(line['Content']).strip().split()
-            # logmessageL = filter(lambda x: x != '', re.split('[\s=:,]', self.preprocess(line['Content'])))
-            matchCluster = self.treeSearch(rootNode, logmessageL)
-
-            #Match no existing log cluster
-            if matchCluster is None:
-                newCluster = Logcluster(logTemplate=logmessageL, logIDL=[logID])
-                logCluL.append(newCluster)
-                self.addSeqToPrefixTree(rootNode, newCluster)
-
-            #Add the new log message to the existing cluster
-            else:
-                newTemplate = self.getTemplate(logmessageL, matchCluster.logTemplate)
-                matchCluster.logIDL.append(logID)
-                if ' '.join(newTemplate) != ' '.join(matchCluster.logTemplate): 
-                    matchCluster.logTemplate = newTemplate
+        logCluL, assignments = self.clusterLogs(self.df_log['Content'])
+
+        if not os.path.exists(self.savePath):
+            os.makedirs(self.savePath)
+
+        self.outputResult(logCluL, assignments)
+
+        print('Parsing done. [Time taken: {!s}]'.format(datetime.now() - start_time))
+
+    def parse_sharded(self, logName, workers=None):
+        """ Parallel version of parse. The log file is split in byte ranges (one per worker) that are clustered by
+        independent Drain trees in a process pool, and the clusters of the shards are then merged into a global set
+        of templates by running Drain over the templates of the shards. The EventIds are computed from the merged
+        templates, the same way as in parse. The result can differ from the sequential parser, because every shard
+        starts with an empty tree, use evaluate_sharding to measure the difference on a given log file.
+        """
+        print('Parsing file in shards: ' + os.path.join(self.path, logName))
+        start_time = datetime.now()
+        self.logName = logName
+
+        self.load_data()
+
+        logCluL, assignments = self.clusterShards(workers or os.cpu_count())
+
+        if not os.path.exists(self.savePath):
+            os.makedirs(self.savePath)
+
+        self.outputResult(logCluL, assignments)
 
-            count += 1
-            if count % 1000 == 0 or count == len(self.df_log):
-                print('Processed {0:.1f}% of log lines.'.format(count * 100.0 / len(self.df_log)))
+        print('Parsing done. [Time taken: {!s}]'.format(datetime.now() - start_time))
 
+    def parse_streaming(self, logName, output_format='csv', chunk_size=100000):
+        """ Memory bounded version of parse that never builds the full data frame of the log file. The lines are read
+        one by one and clustered on the fly, while their fields and the index of their cluster are spooled in chunks to
+        a temporary file. Since the template of a cluster can change until the last line is clustered, the structured
+        rows are written in a second pass over the spooled chunks, with the final templates. Only the cluster tree,
+        the templates and one chunk of lines are kept in memory.
+        :param output_format: csv (same output as parse) or parquet
+        :param chunk_size: the number of lines in one chunk
+        """
+        print('Parsing file in streaming mode: ' + os.path.join(self.path, logName))
+        start_time = datetime.now()
+        self.logName = logName
+        headers, regex = self.generate_logformat_regex(self.log_format)
+        content_index = headers.index('Content')
 
         if not os.path.exists(self.savePath):
             os.makedirs(self.savePath)
+        spool_path = os.path.join(self.savePath, self.logName + '_spool.tmp')
 
-        self.outputResult(logCluL)
+        rootNode = Node()
+        logCluL = []
+        self.repeatCache.clear()
+        occurrences = []
+        linecount = 0
+        try:
+            with open(os.path.join(self.path, logName), 'r') as fin, open(spool_path, 'wb') as spool:
+                messages, clusters = [], []
+                for message in self.match_log_lines(fin, regex, headers):
+                    logClust = self.clusterMessage(rootNode, logCluL, self.preprocess(message[content_index]))
+                    cluster = logClust.clusterId
+                    if cluster == len(occurrences):
+                        occurrences.append(0)
+                    occurrences[cluster] += 1
+                    messages.append(message)
+                    clusters.append(cluster)
+                    linecount += 1
+                    if len(messages) == chunk_size:
+                        pickle.dump((messages, clusters), spool, protocol=pickle.HIGHEST_PROTOCOL)
+                        messages, clusters = [], []
+                        print('Processed {0} log lines.'.format(linecount))
+                if messages:
+                    pickle.dump((messages, clusters), spool, protocol=pickle.HIGHEST_PROTOCOL)
+            print('Processed {0} log lines.'.format(linecount))
+
+            self.outputStreamingResult(logCluL, occurrences, headers, spool_path, output_format)
+        finally:
+            if os.path.exists(spool_path):
+                os.remove(spool_path)
 
         print('Parsing done. [Time taken: {!s}]'.format(datetime.now() - start_time))
 
+    def outputStreamingResult(self, logCluL, occurrences, headers, spool_path, output_format):
+        templates = np.array([' '.join(logClust.logTemplate) for logClust in logCluL], dtype=object)
+        template_ids = np.array([hashlib.md5(template.encode('utf-8')).hexdigest()[0:8] for template in templates],
+                                dtype=object)
+        first_lines = {}
+
+        writer = StructuredLogWriter(os.path.join(self.savePath, self.logName + '_structured'), output_format,
+                                     headers, self.keep_para)
+        with open(spool_path, 'rb') as spool:
+            offset = 0
+            while True:
+                try:
+                    messages, clusters = pickle.load(spool)
+                except EOFError:
+                    break
+                df_chunk = pd.DataFrame(messages, columns=headers)
+                df_chunk.insert(0, 'LineId', np.arange(offset + 1, offset + len(messages) + 1))
+                df_chunk['EventId'] = template_ids[clusters]
+                df_chunk['EventTemplate'] = templates[clusters]
+                if self.keep_para:
+                    df_chunk["ParameterList"] = extract_parameter_lists(df_chunk['EventTemplate'], df_chunk['Content'])
+                writer.write(df_chunk)
+                for cluster, line in zip(clusters, range(offset, offset + len(messages))):
+                    first_lines.setdefault(cluster, line)
+                offset += len(messages)
+        writer.close()
+
+        # same as in outputResult: one row per distinct template, in order of the first occurrence of the template
+        df_event = pd.DataFrame({
+            'EventTemplate': templates,
+            'EventId': template_ids,
+            'Occurrences': occurrences,
+            'FirstLine': [first_lines[i] for i in range(len(logCluL))]
+        })
+        df_event = df_event.groupby(['EventTemplate', 'EventId'], sort=False, as_index=False) \
+            .agg({'Occurrences': 'sum', 'FirstLine': 'min'}).sort_values('FirstLine', kind='stable')
+        df_event.to_csv(os.path.join(self.savePath, self.logName + '_templates.csv'), escapechar='\\', index=False, columns=["EventId", "EventTemplate", "Occurrences"])
+
+    def evaluate_sharding(self, logName, workers=None):
+        """ Function that parses the log file both sequentially and in shards (without writing the results) and
+        reports the grouping accuracy of the sharded parser, using the groups of the sequential parser as ground truth
+        """
+        self.logName = logName
+        self.load_data()
+
+        start_time = datetime.now()
+        sequential = self.clusterLogs(self.df_log['Content'], verbose=False)[1]
+        sequential_time = datetime.now() - start_time
+
+        start_time = datetime.now()
+        sharded = self.clusterShards(workers or os.cpu_count())[1]
+        sharded_time = datetime.now() - start_time
+
+        accuracy = grouping_accuracy(sequential, sharded)
+        report = {
+            'grouping_accuracy': accuracy,
+            'accuracy_delta': 1.0 - accuracy,
+            'sequential_templates': len(np.unique(sequential)),
+            'sharded_templates': len(np.unique(sharded)),
+            'sequential_time': sequential_time,
+            'sharded_time': sharded_time
+        }
+        print('Sharded parsing: grouping accuracy {0:.4f} ({1} vs {2} templates), time {3!s} vs {4!s}'.format(
+            accuracy, report['sharded_templates'], report['sequential_templates'], sharded_time, sequential_time))
+        return report
+
+    def clusterLogs(self, contents, verbose=True):
+        """ Function that runs Drain over the log messages
+        :return: tuple (list of the created log clusters, int32 array with the index of the cluster of every message)
+        """
+        rootNode = Node()
+        logCluL = []
+        self.repeatCache.clear()
+
+        contents = list(contents)
+
+        total = len(contents)
+        assignments = np.empty(total, dtype=np.int32)
+        count = 0
+        for batch_start in range(0, total, MASKING_BATCH_SIZE):
+            for line in self.masking.mask_batch(contents[batch_start:batch_start + MASKING_BATCH_SIZE]):
+                # logmessageL = filter(lambda x: x != '', re.split('[\s=:,]', self.preprocess(content)))
+                assignments[count] = self.clusterMessage(rootNode, logCluL, line).clusterId
+
+                count += 1
+                if verbose and (count % 1000 == 0 or count == total):
+                    print('Processed {0:.1f}% of log lines.'.format(count * 100.0 / total))
+        if verbose:
+            print('Repeat cache: {hits} hits, {misses} misses.'.format(**self.repeatCache.stats()))
+
+        return logCluL, assignments
+
+    def clusterMessage(self, rootNode, logCluL, line):
+        """ Function that clusters a preprocessed log message like addSeqToClusters, returning the cached cluster for
+        the exact repeats of a message in the repeat cache
+        """
+        logClust = self.repeatCache.get(line, self.treeVersion)
+        if logClust is not None:
+            return logClust
+
+        logmessageL = line.strip().split()
+        logClust, logClustL = self.matchSeqToClusters(rootNode, logCluL, logmessageL)
+        if logClustL is None:
+            # a new cluster can be matched again only if the message is similar enough to its own template
+            logClustL = self.leafSearch(rootNode, logmessageL)
+            if self.fastMatch(logClustL, logmessageL) is not logClust:
+                return logClust
+        self.repeatCache.put(line, logClust, logClustL, self.treeVersion)
+        return logClust
+
+    def addSeqToClusters(self, rootNode, logCluL, logmessageL):
+        """ Function that finds the cluster of the (preprocessed and split) log message, updating its template, or
+        creates a new cluster if no existing cluster matches the message
+        """
+        return self.matchSeqToClusters(rootNode, logCluL, logmessageL)[0]
+
+    def matchSeqToClusters(self, rootNode, logCluL, logmessageL):
+        """ Function that does the same as addSeqToClusters
+        :return: tuple (cluster, leaf of the matched cluster), the leaf is None if a new cluster was created
+        """
+        logClustL = self.leafSearch(rootNode, logmessageL)
+        matchCluster = self.fastMatch(logClustL, logmessageL)
+
+        #Match no existing log cluster
+        if matchCluster is None:
+            newCluster = Logcluster(logTemplate=logmessageL, clusterId=len(logCluL))
+            logCluL.append(newCluster)
+            self.addSeqToPrefixTree(rootNode, newCluster)
+            return newCluster, None
+
+        #Add the new log message to the existing cluster
+        newTemplate = self.getTemplate(logmessageL, matchCluster.logTemplate)
+        if ' '.join(newTemplate) != ' '.join(matchCluster.logTemplate):
+            logClustL.updateTemplate(matchCluster, newTemplate)
+        return matchCluster, logClustL
+
+    def clusterShards(self, workers):
+        """ Function that clusters the byte ranges of the log file in a process pool and merges the clusters of the
+        shards. The output has the same format as the one of clusterLogs, with one assignment per row of self.df_log
+        and the templates merged across the shards. The clusters can differ from the ones of clusterLogs, since every
+        shard is clustered independently (see evaluate_sharding).
+        """
+        log_file = os.path.join(self.path, self.logName)
+        bounds = split_file(log_file, workers)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            shards = list(executor.map(_cluster_shard, [self.get_settings()] * workers, [log_file] * workers,
+                                       bounds[:-1], bounds[1:]))
+
+        # the templates of the shards are merged by clustering them again, in the order of the shards
+        rootNode = Node()
+        logCluL = []
+        assignments = []
+        for templates, shard_assignments in shards:
+            mapping = [self.addSeqToClusters(rootNode, logCluL, template).clusterId for template in templates]
+            assignments.append(np.asarray(mapping, dtype=np.int32)[shard_assignments])
+        assignments = np.concatenate(assignments) if assignments else np.empty(0, dtype=np.int32)
+        assert len(assignments) == self.df_log.shape[0]
+        return logCluL, assignments
+
+    def get_settings(self):
+        """ Function that returns the arguments needed to create a parser with the same settings
+        """
+        return {'log_format': self.log_format, 'indir': self.path, 'outdir': self.savePath, 'depth': self.depth + 2,
+                'st': self.st, 'maxChild': self.maxChild, 'rex': self.rex, 'keep_para': self.keep_para,
+                'repeat_cache_size': self.repeat_cache_size,
+                'replacements': self.replacements}
+
     def load_data(self):
         headers, regex = self.generate_logformat_regex(self.log_format)
         self.df_log = self.log_to_dataframe(os.path.join(self.path, self.logName), regex, headers, self.log_format)
 
     def preprocess(self, line):
-        for currentRex in self.rex:
-            line = re.sub(currentRex, '<*>', line)
-        return line
+        return self.masking.mask(line)
 
     def log_to_dataframe(self, log_file, regex, headers, logformat):
         """ Function to transform log file to dataframe 
         """
-        log_messages = []
-        linecount = 0
         with open(log_file, 'r') as fin:
-            for line in fin.readlines():
-                try:
-                    match = regex.search(line.strip())
-                    message = [match.group(header) for header in headers]
-                    log_messages.append(message)
-                    linecount += 1
-                except Exception as e:
-                    pass
+            log_messages = list(self.match_log_lines(fin, regex, headers))
+        linecount = len(log_messages)
         logdf = pd.DataFrame(log_messages, columns=headers)
         logdf.insert(0, 'LineId', None)
         logdf['LineId'] = [i + 1 for i in range(linecount)]
         return logdf
 
 
+    def match_log_lines(self, lines, regex, headers):
+        """ Function that yields the values of the headers for the lines that match the log format, after applying the
+        replacements to the lines
+        """
+        for line in lines:
+            for old, new in self.replacements:
+                line = line.replace(old, new)
+            try:
+                match = regex.search(line.strip())
+                message = [match.group(header) for header in headers]
+                yield message
+            except Exception as e:
+                pass
+
     def generate_logformat_regex(self, logformat):
         """ Function to generate regular expression to split log messages
         """
@@ -333,12 +719,290 @@ class LogParser:
         return headers, regex
 
     def get_parameter_list(self, row):
-        template_regex = re.sub(r"<.{1,5}>", "<*>", row["EventTemplate"])
-        if "<*>" not in template_regex: return []
-        template_regex = re.sub(r'([^A-Za-z0-9])', r'\\\1', template_regex)
-        template_regex = re.sub(r'\\ +', r'\\s+', template_regex)
-        template_regex = "^" + template_regex.replace("\<\*\>", "(.*?)") + "$"
-        parameter_list = re.findall(template_regex, row["Content"])
-        parameter_list = parameter_list[0] if parameter_list else ()
-        parameter_list = list(parameter_list) if isinstance(parameter_list, tuple) else [parameter_list]
-        return parameter_list
\ No newline at end of file
+        template_regex = compile_template_regex(row["EventTemplate"])
+        if template_regex is None: return []
+        return match_parameter_list(template_regex, row["Content"])
+
+
+class OnlineLogParser(LogParser):
+    """ Persistent and resumable version of the Drain parser, for logs that arrive continuously. The prefix tree and
+    the log clusters are kept between the calls, so every new batch of lines is clustered against everything seen so
+    far and the EventIds are returned immediately. When a cluster generalizes, its template (and so its EventId)
+    changes, these changes are reported together with the EventIds of the batch.
+    The state can be saved to a json file and loaded back to continue from where the parser stopped.
+    """
+
+    def __init__(self, log_format, depth=4, st=0.4, maxChild=100, rex=[], **kwargs):
+        LogParser.__init__(self, log_format, depth=depth, st=st, maxChild=maxChild, rex=rex, **kwargs)
+        self.headers, self.format_regex = self.generate_logformat_regex(log_format)
+        self.rootNode = Node()
+        self.logCluL = []
+        self.clusterIds = {}
+        self.lastTemplates = []
+        self.eventIds = []
+        self.occurrences = []
+
+    def add_log_lines(self, lines):
+        """ Function that clusters raw log lines, formatted as in log_format
+        :return: tuple (EventIds, template updates) as returned by add_log_messages for the contents of the lines, the
+        EventId of the lines that do not match the log format is None
+        """
+        lines = list(lines)
+        content_index = self.headers.index('Content')
+        positions = []
+        contents = []
+        for position, line in enumerate(lines):
+            for message in self.match_log_lines([line], self.format_regex, self.headers):
+                positions.append(position)
+                contents.append(message[content_index])
+        # the matched lines are clustered as one batch, so that they get the EventIds of the templates after the batch
+        matched_event_ids, updates = self.add_log_messages(contents)
+        event_ids = [None] * len(lines)
+        for position, event_id in zip(positions, matched_event_ids):
+            event_ids[position] = event_id
+        return event_ids, updates
+
+    def add_log_messages(self, contents):
+        """ Function that clusters the contents of log messages
+        :return: tuple (EventIds, template updates). The EventIds are the ones of the templates after clustering the
+        whole batch, each template update is a dictionary with the ClusterId, the OldEventId, and the new EventId and
+        EventTemplate of a cluster that generalized while clustering the batch
+        """
+        clusters = []
+        updates = {}
+        for content in contents:
+            logClust = self.clusterMessage(self.rootNode, self.logCluL, self.preprocess(content))
+            clusterId = self.clusterIds.get(id(logClust))
+            if clusterId is None:
+                clusterId = len(self.lastTemplates)
+                self.clusterIds[id(logClust)] = clusterId
+                self.lastTemplates.append(logClust.logTemplate)
+                self.eventIds.append(template_event_id(logClust.logTemplate))
+                self.occurrences.append(0)
+            elif logClust.logTemplate is not self.lastTemplates[clusterId]:
+                update = updates.setdefault(clusterId, {'ClusterId': clusterId, 'OldEventId': self.eventIds[clusterId]})
+                self.lastTemplates[clusterId] = logClust.logTemplate
+                self.eventIds[clusterId] = template_event_id(logClust.logTemplate)
+                update['EventId'] = self.eventIds[clusterId]
+                update['EventTemplate'] = ' '.join(logClust.logTemplate)
+            self.occurrences[clusterId] += 1
+            clusters.append(clusterId)
+        return [self.eventIds[clusterId] for clusterId in clusters], list(updates.values())
+
+    def get_templates(self):
+        """ Function that returns the current templates, in the same shape as the templates file of parse: the clusters
+        with identical templates are merged in one row (with one EventId) and the sum of their occurrences
+        """
+        templates = pd.DataFrame({
+            'EventId': self.eventIds,
+            'EventTemplate': [' '.join(template) for template in self.lastTemplates],
+            'Occurrences': self.occurrences
+        })
+        return templates.groupby(['EventId', 'EventTemplate'], sort=False, as_index=False)['Occurrences'].sum()
+
+    def save(self, path):
+        """ Function that saves the settings, the clusters and the prefix tree of the parser to a json file
+        """
+        state = {
+            'settings': self.get_settings(),
+            'clusters': [{'template': logClust.logTemplate, 'occurrences': occurrences}
+                         for logClust, occurrences in zip(self.logCluL, self.occurrences)],
+            'tree': self.nodeToDict(self.rootNode)
+        }
+        with open(path, 'w') as f:
+            json.dump(state, f)
+
+    @classmethod
+    def load(cls, path):
+        """ Function that creates a parser from the state saved with save
+        """
+        with open(path) as f:
+            state = json.load(f)
+        parser = cls(**state['settings'])
+        for cluster in state['clusters']:
+            logClust = Logcluster(logTemplate=cluster['template'], clusterId=len(parser.logCluL))
+            parser.clusterIds[id(logClust)] = len(parser.logCluL)
+            parser.logCluL.append(logClust)
+            parser.lastTemplates.append(logClust.logTemplate)
+            parser.eventIds.append(template_event_id(logClust.logTemplate))
+            parser.occurrences.append(cluster['occurrences'])
+        parser.rootNode = parser.nodeFromDict(state['tree'])
+        return parser
+
+    def nodeToDict(self, node):
+        # the keys of the first layer are the lengths of the messages, so the children are stored as pairs
+        if isinstance(node.childD, ClusterLeaf):
+            children = {'clusters': [self.clusterIds[id(logClust)] for logClust in node.childD]}
+        else:
+            children = {'children': [[key, self.nodeToDict(child)] for key, child in node.childD.items()]}
+        return {'depth': node.depth, 'digitOrtoken': node.digitOrtoken, **children}
+
+    def nodeFromDict(self, state):
+        if 'clusters' in state:
+            childD = ClusterLeaf()
+            for clusterId in state['clusters']:
+                childD.add(self.logCluL[clusterId])
+        else:
+            childD = {key: self.nodeFromDict(child) for key, child in state['children']}
+        return Node(childD=childD, depth=state['depth'], digitOrtoken=state['digitOrtoken'])
+
+
+def template_event_id(logTemplate):
+    """ Function that returns the EventId of a template (given as a list of tokens), the same as in outputResult
+    """
+    return hashlib.md5(' '.join(logTemplate).encode('utf-8')).hexdigest()[0:8]
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template_regex(template):
+    """ Function that compiles the regular expression that extracts the parameters of a template. The compiled
+    expressions of the most recently used templates are cached, so the expression of a template is built only once.
+    :return: the compiled expression, or None if the template has no parameters
+    """
+    template_regex = re.sub(r"<.{1,5}>", "<*>", template)
+    if "<*>" not in template_regex: return None
+    template_regex = re.sub(r'([^A-Za-z0-9])', r'\\\1', template_regex)
+    template_regex = re.sub(r'\\ +', r'\\s+', template_regex)
+    template_regex = "^" + template_regex.replace("\<\*\>", "(.*?)") + "$"
+    return re.compile(template_regex)
+
+
+def match_parameter_list(template_regex, content):
+    parameter_list = template_regex.findall(content)
+    parameter_list = parameter_list[0] if parameter_list else ()
+    parameter_list = list(parameter_list) if isinstance(parameter_list, tuple) else [parameter_list]
+    return parameter_list
+
+
+def extract_parameter_lists(templates, contents):
+    """ Function that extracts the parameter lists of many log lines, the same as LogParser.get_parameter_list. The
+    lines are grouped by template, so that the compiled expression of each template is looked up once and then run
+    over all lines of its group.
+    :param templates: pandas Series with the template of every line
+    :param contents: pandas Series with the content of every line, with the same index as templates
+    :return: list with the parameter list of every line
+    """
+    parameter_lists = [[] for _ in range(len(templates))]
+    contents = contents.to_numpy(dtype=object)
+    codes, unique_templates = pd.factorize(templates)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(unique_templates) + 1))
+    for code, template in enumerate(unique_templates):
+        template_regex = compile_template_regex(template)
+        if template_regex is None:
+            continue
+        for position in order[bounds[code]:bounds[code + 1]]:
+            parameter_lists[position] = match_parameter_list(template_regex, contents[position])
+    return parameter_lists
+
+def find_in_parameters(templates, contents, pattern):
+    """ Function that finds, for every log line, the last match of pattern in the first parameter that contains a
+    match, with the parameters extracted as in LogParser.get_parameter_list. The lines are grouped by template and
+    the parameters of a group are extracted at once with pandas.
+    :param templates: pandas Series with the template of every line
+    :param contents: pandas Series with the content of every line
+    :param pattern: regular expression, without groups
+    :return: object array with the match of every line, None for the lines without match
+    """
+    result = np.full(len(contents), None, dtype=object)
+    contents = pd.Series(contents.to_numpy(dtype=object))
+    codes, unique_templates = pd.factorize(templates)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(unique_templates) + 1))
+    for code, template in enumerate(unique_templates):
+        template_regex = compile_template_regex(template)
+        if template_regex is None:
+            continue
+        positions = order[bounds[code]:bounds[code + 1]]
+        parameters = contents.iloc[positions].str.extract(template_regex.pattern, expand=True)
+        found = pd.Series(None, index=parameters.index, dtype=object)
+        for column in parameters.columns:
+            found = found.fillna(parameters[column].str.extract('.*(' + pattern + ')', expand=False))
+        result[positions] = found.where(found.notna(), None).to_numpy(dtype=object)
+    return result
+
+
+def split_file(log_file, shards):
+    """ Function that splits the file in byte ranges that end at line boundaries
+    :return: list with shards + 1 offsets, the i-th range is bounds[i]:bounds[i + 1]
+    """
+    size = os.path.getsize(log_file)
+    bounds = [0]
+    with open(log_file, 'rb') as f:
+        for i in range(1, shards):
+            f.seek(max(size * i // shards, bounds[-1]))
+            f.readline()
+            bounds.append(max(min(f.tell(), size), bounds[-1]))
+    bounds.append(size)
+    return bounds
+
+
+def read_lines(log_file, start, end):
+    """ Function that reads the lines in the byte range start:end of the file, the same way as open(log_file, 'r')
+    """
+    with open(log_file, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return io.StringIO(data.decode(locale.getpreferredencoding(False)), newline=None).readlines()
+
+
+def _cluster_shard(settings, log_file, start, end):
+    parser = LogParser(**settings)
+    headers, regex = parser.generate_logformat_regex(parser.log_format)
+    content_index = headers.index('Content')
+    contents = [message[content_index] for message in parser.match_log_lines(read_lines(log_file, start, end),
+                                                                              regex, headers)]
+    logCluL, assignments = parser.clusterLogs(contents, verbose=False)
+    return [logClust.logTemplate for logClust in logCluL], assignments
+
+
+def grouping_accuracy(truth, predicted):
+    """ Function that computes the grouping accuracy of a parser: the fraction of the log lines whose predicted group
+    contains exactly the same lines as their ground truth group
+    :param truth: array with the ground truth group of every line
+    :param predicted: array with the predicted group of every line
+    """
+    if len(truth) == 0:
+        return 1.0
+    groups = pd.DataFrame({'truth': truth, 'predicted': predicted})
+    predicted_groups = groups.groupby('predicted')['truth'].agg(['nunique', 'first', 'size'])
+    truth_sizes = groups.groupby('truth').size()
+    correct = predicted_groups[(predicted_groups['nunique'] == 1)
+                               & (truth_sizes.reindex(predicted_groups['first']).to_numpy() == predicted_groups['size'])]
+    return correct['size'].sum() / len(truth)
+
+
+class StructuredLogWriter:
+    """ Writer of the structured logs in chunks, as a csv file (the same as the one written by LogParser.parse) or
+    as a parquet file
+    """
+
+    def __init__(self, path, output_format, headers, keep_para):
+        if output_format not in ('csv', 'parquet'):
+            raise ValueError('Unsupported output format: ' + output_format)
+        self.path = path + '.' + output_format
+        self.output_format = output_format
+        self.columns = ['LineId'] + headers + ['EventId', 'EventTemplate'] + (['ParameterList'] if keep_para else [])
+        self.parquet_writer = None
+        self.empty = True
+
+    def write(self, df_chunk):
+        if self.output_format == 'csv':
+            df_chunk.to_csv(self.path, escapechar='\\', index=False, mode='w' if self.empty else 'a',
+                            header=self.empty)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            schema = pa.schema([(column, pa.int64() if column == 'LineId' else
+                                 pa.list_(pa.string()) if column == 'ParameterList' else pa.string())
+                                for column in self.columns])
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(self.path, schema)
+            self.parquet_writer.write_table(pa.Table.from_pandas(df_chunk, schema=schema, preserve_index=False))
+        self.empty = False
+
+    def close(self):
+        if self.empty:
+            self.write(pd.DataFrame({column: pd.Series(dtype='int64' if column == 'LineId' else object)
+                                     for column in self.columns}))
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+from os.path import exists
+
+import pandas as pd
+from pyarrow import feather
+
+# Increase when the format of the cached frames changes, so that the old cache files are not used anymore
+CACHE_VERSION = 2
+
+
+def file_checksum(path: str, checksums_file: str = None, chunk_size: int = 1 << 23) -> str:
+    """
+    Method that computes the blake2b checksum of the content of a file. Hashing a multi-GB log takes a few seconds, so
+    when checksums_file is given the checksum is stored there together with the size and the modification time of the
+    file, and it is recomputed only when one of them changes.
+    :param path: path to the file
+    :param checksums_file: path to a json file used to store the already computed checksums
+    :param chunk_size: the number of bytes read at once
+    :return: hex digest of the content of the file
+    """
+    stat = os.stat(path)
+    signature = [stat.st_size, stat.st_mtime_ns]
+    checksums = {}
+    if checksums_file is not None and exists(checksums_file):
+        with open(checksums_file) as f:
+            checksums = json.load(f)
+        cached = checksums.get(os.path.abspath(path))
+        if cached is not None and cached['signature'] == signature:
+            return cached['checksum']
+
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    checksum = digest.hexdigest()
+
+    if checksums_file is not None:
+        checksums[os.path.abspath(path)] = {'signature': signature, 'checksum': checksum}
+
+        def write_checksums(tmp_path):
+            with open(tmp_path, 'w') as f:
+                json.dump(checksums, f)
+
+        write_atomically(checksums_file, write_checksums)
+    return checksum
+
+
+def cache_key(name: str, source_files: list, settings: dict, checksums_file: str = None,
+              version: int = CACHE_VERSION) -> str:
+    """
+    :param name: the name of the cached object e.g. the name of the dataset class
+    :param source_files: the files from which the cached object is computed
+    :param settings: json serializable dictionary with the settings (e.g. of the parser) used for the computation
+    :param checksums_file: see file_checksum
+    :param version: the version of the format of the cached object, None if the key should not depend on CACHE_VERSION
+    (e.g. for the output of the parser, which does not change with the format of the cached frames)
+    :return: key that changes whenever the content of a source file or a setting changes
+    """
+    description = {
+        'name': name,
+        'sources': [file_checksum(path, checksums_file) for path in source_files],
+        'settings': settings
+    }
+    if version is not None:
+        description['version'] = version
+    return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def write_cached_frame(df: pd.DataFrame, path: str):
+    """
+    Method that stores the data frame as an uncompressed Feather (Arrow IPC) file, which can be memory-mapped when read
+    """
+    df = df.reset_index(drop=True)
+    write_atomically(path, lambda tmp_path: feather.write_feather(df, tmp_path, compression='uncompressed'))
+
+
+def read_cached_frame(path: str) -> pd.DataFrame:
+    """
+    Method that reads a data frame stored with write_cached_frame by memory-mapping the file. The columns are not
+    consolidated in blocks, so the numeric columns (and the codes of the categorical columns) are views of the mapped
+    file, shared by all processes that read it, instead of copies.
+    """
+    return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+
+
+def is_artifact_current(path: str, key: str) -> bool:
+    """
+    Method that checks whether the file exists and was marked with mark_artifact_current with the same key, e.g. to
+    reuse the output of a previous parse of the same source files with the same settings
+    """
+    key_path = f'{path}.key'
+    if not exists(path) or not exists(key_path):
+        return False
+    with open(key_path) as f:
+        return f.read() == key
+
+
+def mark_artifact_current(path: str, key: str):
+    """
+    Method that marks the (completely written) file with the key of the sources and settings it was computed from
+    """
+    def write_key(tmp_path):
+        with open(tmp_path, 'w') as f:
+            f.write(key)
+
+    write_atomically(f'{path}.key', write_key)
+
+
+def write_atomically(path: str, write):
+    """
+    Method that calls write with a temporary path and moves the written file to path, so that the readers never see a
+    partially written file
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if exists(tmp_path):
+            os.remove(tmp_path)
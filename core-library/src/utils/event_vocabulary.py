@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+
+class EventVocabulary:
+    """
+    Class that maps the string event ids (the md5 prefixes generated by DRAIN) to dense int32 codes and back.
+    The code of an event id is its position in the vocabulary, so the codes are in the range [0, len(vocabulary)).
+    """
+
+    def __init__(self, event_ids):
+        self.event_ids = pd.Index(list(event_ids), dtype=object)
+        if not self.event_ids.is_unique:
+            raise ValueError("The event ids in the vocabulary should be unique")
+
+    @classmethod
+    def from_event_ids(cls, event_ids: pd.Series):
+        """
+        :param event_ids: the event ids of the logs, possibly with repetitions
+        :return: vocabulary with the unique event ids in order of their first occurrence
+        """
+        return cls(pd.unique(event_ids.dropna()))
+
+    @classmethod
+    def from_categorical(cls, event_ids: pd.Series):
+        """
+        :param event_ids: categorical series with the event ids of the logs
+        :return: vocabulary with the categories of the series, so that the codes of the categories are also the codes
+        of the vocabulary
+        """
+        return cls(event_ids.cat.categories)
+
+    def __len__(self):
+        return len(self.event_ids)
+
+    def encode(self, event_ids) -> np.ndarray:
+        """
+        :param event_ids: sequence of event ids
+        :return: int32 array with the codes of the event ids, -1 for the event ids that are not in the vocabulary
+        """
+        if isinstance(getattr(event_ids, 'dtype', None), pd.CategoricalDtype) and \
+                self.event_ids.equals(event_ids.cat.categories):
+            # the codes of the categories are already the codes of the vocabulary
+            return event_ids.cat.codes.to_numpy(dtype=np.int32)
+        return self.event_ids.get_indexer(event_ids).astype(np.int32)
+
+    def decode(self, codes) -> np.ndarray:
+        """
+        :param codes: sequence of codes
+        :return: object array with the event ids that correspond to the codes
+        """
+        return self.event_ids.values[np.asarray(codes)]
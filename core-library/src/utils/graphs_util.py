@@ -1,49 +1,98 @@
 from abc import abstractmethod, ABC
 
 import networkx as nx
+import numpy as np
 import pandas as pd
 
+from utils.event_vocabulary import EventVocabulary
+from utils.parallel_utils import SharedArray, map_in_process_pool
 from utils.window_utils import TumblingWindowCreator, SlidingWindowCreator
 
 
 class GraphCreator(ABC):
-    def __init__(self, logs: pd.DataFrame, include_last: bool):
+    def __init__(self, logs: pd.DataFrame, include_last: bool, vocabulary: EventVocabulary = None,
+                 as_dict: bool = True, workers: int = 1):
+        """
+        :param logs: the logs with at least the event_id column. If the event ids are categorical with the event ids of
+        the vocabulary as categories, the codes of the categories are used directly
+        :param include_last: A bool value that represents whether the last event ID should be included in the graph generation
+        :param vocabulary: the vocabulary of the event ids, if not provided it is built from the logs
+        :param as_dict: whether the graphs should be translated to the dictionary representation (key `graph_dict`) or
+        returned as TransitionGraph objects (key `graph`)
+        :param workers: the number of processes used for the generation of the graphs
+        """
         self.logs = logs
         self.include_last = include_last
+        self.vocabulary = vocabulary if vocabulary is not None else EventVocabulary.from_event_ids(logs['event_id'])
+        self.as_dict = as_dict
+        self.workers = workers
 
     @abstractmethod
-    def create_graphs(self):
+    def iter_graphs(self):
+        """
+        :return: generator that yields the graph of one window/session at a time
+        """
         pass
 
+    def create_graphs(self):
+        return list(self.iter_graphs())
+
     @abstractmethod
     def get_window_creator(self):
         pass
 
+    def get_event_codes(self, logs: pd.DataFrame) -> np.ndarray:
+        return self.vocabulary.encode(logs['event_id'])
+
+    def format_graph(self, graph) -> dict:
+        if self.as_dict:
+            return {'graph_dict': graph.to_dict(self.vocabulary)}
+        return {'graph': graph}
+
 
 class GraphFromTimeWindowCreator(GraphCreator, ABC):
-    def __init__(self, logs: pd.DataFrame, include_last: bool, window_size: int):
-        GraphCreator.__init__(self, logs, include_last)
+    def __init__(self, logs: pd.DataFrame, include_last: bool, window_size: int, vocabulary: EventVocabulary = None,
+                 as_dict: bool = True, workers: int = 1):
+        GraphCreator.__init__(self, logs, include_last, vocabulary, as_dict, workers)
         self.window_size = window_size
 
-    def create_graphs(self):
+    def iter_graphs(self):
+        """
+        Sweep-line construction of the window graphs. The logs are sorted by timestamp once, the boundaries of every
+        window are found with a binary search over the timestamps and the events of each window are then taken as a
+        contiguous slice of the sorted event sequence, so the cost is O(rows + windows) instead of one full scan of the
+        logs per window.
+        """
         windows = self.get_window_creator().create_windows()
-        windows['event_ids'] = windows.apply(lambda window: get_events_ids_for_window(self.logs, window), axis=1)
-        result = []
-        for index, row in windows.iterrows():
-            # Hack fix, think of a better one later
-            r = [] if pd.isnull(row['event_ids']) else row['event_ids'].split(',')
-            result.append({
-                'start': str(row['start']),
-                'end': str(row['end']),
-                'graph_dict': create_graph_as_dict(event_ids=r, include_last=self.include_last)
-            })
-
-        return result
+        logs = self.logs
+        if not logs['timestamp'].is_monotonic_increasing:
+            logs = logs.sort_values('timestamp', kind='mergesort')
+        event_codes = self.get_event_codes(logs)
+        lower, upper = find_window_boundaries(logs['timestamp'].values, windows['start'].values, windows['end'].values)
+        if self.workers > 1:
+            graphs = create_window_graphs_in_parallel(self.get_window_graphs_function(), event_codes, lower, upper,
+                                                      self.include_last, self.workers)
+        else:
+            graphs = self.get_window_graphs_function()(event_codes, lower, upper, self.include_last)
+        for start, end, graph in zip(windows['start'], windows['end'], graphs):
+            yield {
+                'start': str(start),
+                'end': str(end),
+                **self.format_graph(graph)
+            }
+
+    def get_window_graphs_function(self):
+        """
+        :return: module level function that creates the graphs of a sequence of windows, called as
+        function(event_codes, lower, upper, include_last)
+        """
+        return create_window_graphs
 
 
 class GraphFromTumblingWindowCreator(GraphFromTimeWindowCreator):
-    def __init__(self, logs: pd.DataFrame, include_last: bool, window_size: int):
-        GraphFromTimeWindowCreator.__init__(self, logs, include_last, window_size)
+    def __init__(self, logs: pd.DataFrame, include_last: bool, window_size: int, vocabulary: EventVocabulary = None,
+                 as_dict: bool = True, workers: int = 1):
+        GraphFromTimeWindowCreator.__init__(self, logs, include_last, window_size, vocabulary, as_dict, workers)
 
     def get_window_creator(self):
         return TumblingWindowCreator(
@@ -54,9 +103,15 @@ class GraphFromTumblingWindowCreator(GraphFromTimeWindowCreator):
 
 
 class GraphFromSlidingWindowCreator(GraphFromTimeWindowCreator):
-    def __init__(self, logs: pd.DataFrame, include_last: bool, window_size: int, window_slide: int):
-        GraphFromTimeWindowCreator.__init__(self, logs, include_last, window_size)
+    def __init__(self, logs: pd.DataFrame, include_last: bool, window_size: int, window_slide: int,
+                 incremental: bool = True, vocabulary: EventVocabulary = None, as_dict: bool = True,
+                 workers: int = 1):
+        GraphFromTimeWindowCreator.__init__(self, logs, include_last, window_size, vocabulary, as_dict, workers)
         self.window_slide = window_slide
+        self.incremental = incremental
+
+    def get_window_graphs_function(self):
+        return create_sliding_window_graphs if self.incremental else create_window_graphs
 
     def get_window_creator(self):
         return SlidingWindowCreator(
@@ -68,29 +123,74 @@ class GraphFromSlidingWindowCreator(GraphFromTimeWindowCreator):
 
 
 class GraphFromSessionWindowCreator(GraphCreator):
-    def __init__(self, logs: pd.DataFrame, include_last: bool):
-        GraphCreator.__init__(self, logs, include_last)
-
-    def create_graphs(self):
-        windows_df = self.logs[['session_id', 'event_id']]
-        windows_df['event_ids'] = windows_df.groupby('session_id')['event_id'].transform(lambda x: ','.join(x))
-        windows_df = windows_df[['session_id', 'event_ids']].drop_duplicates()
-        print(windows_df.head())
-        result = []
-        for index, row in windows_df.iterrows():
-            # Hack fix, think of a better one later
-            r = [] if pd.isnull(row['event_ids']) else row['event_ids'].split(',')
-            result.append({
-                'session_id': row['end'],
-                'graph_dict': create_graph_as_dict(event_ids=r, include_last=self.include_last)
-            })
-
-        return result
+    def __init__(self, logs: pd.DataFrame, include_last: bool, vocabulary: EventVocabulary = None,
+                 as_dict: bool = True, workers: int = 1):
+        GraphCreator.__init__(self, logs, include_last, vocabulary, as_dict, workers)
+
+    def iter_graphs(self):
+        session_codes, session_ids = pd.factorize(self.logs['session_id'])
+        event_codes = self.get_event_codes(self.logs)
+        if self.workers > 1:
+            graphs = create_session_transition_graphs_in_parallel(session_codes, session_ids, event_codes,
+                                                                  self.include_last, self.workers)
+        else:
+            graphs = create_session_transition_graphs(session_codes, event_codes, len(session_ids),
+                                                      include_last=self.include_last)
+        for session_id, graph in zip(session_ids, graphs):
+            yield {
+                'session_id': session_id,
+                **self.format_graph(graph)
+            }
 
     def get_window_creator(self):
         pass
 
 
+class TransitionGraph:
+    """
+    Graph of the transitions between events, stored as a sparse matrix in COO format i.e. three parallel arrays with
+    the source codes, the destination codes and the weights of the edges. The codes are the ones of an EventVocabulary,
+    the translation to the dictionary representation of the graph is done only on request with to_dict.
+    """
+    __slots__ = ('src', 'dst', 'weights')
+
+    def __init__(self, src: np.ndarray, dst: np.ndarray, weights: np.ndarray):
+        self.src = src
+        self.dst = dst
+        self.weights = weights
+
+    @classmethod
+    def from_counts(cls, src, dst, counts):
+        """
+        :return: graph where the weight of every edge is its count normalized by the sum of all counts
+        """
+        total = counts.sum()
+        weights = counts / total if total > 0 else counts.astype(np.float64)
+        return cls(np.asarray(src, dtype=np.int32), np.asarray(dst, dtype=np.int32), weights)
+
+    def __len__(self):
+        return len(self.weights)
+
+    def to_dict(self, vocabulary: EventVocabulary) -> dict:
+        """
+        :return: the same dictionary representation of the graph as the one returned by create_graph_as_dict
+        """
+        graph_dict = {}
+        for node1, node2, weight in zip(vocabulary.decode(self.src).tolist(), vocabulary.decode(self.dst).tolist(),
+                                        self.weights.tolist()):
+            graph_dict.setdefault(node1, {})[node2] = weight
+        return graph_dict
+
+    def to_coo_matrix(self, n_nodes: int):
+        """
+        :param n_nodes: the number of nodes i.e. the size of the vocabulary
+        :return: scipy.sparse.coo_matrix of shape (n_nodes, n_nodes) with the weights of the edges. scipy is an optional
+        dependency, installed with the `sparse` extra (pip install logs2graphs[sparse])
+        """
+        from scipy.sparse import coo_matrix
+        return coo_matrix((self.weights, (self.src, self.dst)), shape=(n_nodes, n_nodes))
+
+
 def get_events_ids_for_window(logs_df, window):
     return ",".join(list(logs_df[
                              (logs_df['timestamp'] >= window['start'])
@@ -98,6 +198,183 @@ def get_events_ids_for_window(logs_df, window):
                              ]['event_id']))
 
 
+def find_window_boundaries(timestamps: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> tuple:
+    """
+    Method that finds the positions of the logs that belong to each time window with a binary search
+    :param timestamps: sorted array of the timestamps of the logs
+    :param starts: array with the (inclusive) start of every window
+    :param ends: array with the (exclusive) end of every window
+    :return: A tuple of two integer arrays (lower, upper), such that the logs of the i-th window are
+    the ones at positions lower[i]:upper[i] in the sorted logs.
+    """
+    timestamps = np.asarray(timestamps, dtype='datetime64[ns]')
+    lower = np.searchsorted(timestamps, np.asarray(starts, dtype='datetime64[ns]'), side='left')
+    upper = np.searchsorted(timestamps, np.asarray(ends, dtype='datetime64[ns]'), side='left')
+    return lower, upper
+
+
+def create_transition_graph(event_codes: np.ndarray, include_last: bool) -> TransitionGraph:
+    """
+    Array version of create_graph_as_dict that works on the codes of the event ids
+    :param event_codes: array of the codes of the event ids that occurred in a given window/session
+    :param include_last: A bool value that represents whether the last event ID should be included in the graph generation
+    :return: TransitionGraph with the normalized weights of the transitions between consecutive events
+    """
+    event_codes = np.asarray(event_codes, dtype=np.int64)
+    end = len(event_codes) - 1 if include_last else len(event_codes) - 2
+    if end <= 0:
+        return TransitionGraph.from_counts(np.empty(0), np.empty(0), np.empty(0, dtype=np.int64))
+    keys, counts = np.unique((event_codes[:end] << 32) | event_codes[1:end + 1], return_counts=True)
+    return TransitionGraph.from_counts(keys >> 32, keys & 0xFFFFFFFF, counts)
+
+
+def create_window_graphs(event_codes: np.ndarray, lower: np.ndarray, upper: np.ndarray, include_last: bool):
+    """
+    :param event_codes: the codes of the events of the logs sorted by timestamp
+    :param lower: array with the position of the first log of every window in event_codes
+    :param upper: array with the position after the last log of every window in event_codes
+    :param include_last: A bool value that represents whether the last event ID should be included in the graph generation
+    :return: generator of the TransitionGraph of every window, in the order of the windows
+    """
+    for lo, hi in zip(lower, upper):
+        yield create_transition_graph(event_codes[lo:hi], include_last=include_last)
+
+
+def create_sliding_window_graphs(event_codes: np.ndarray, lower: np.ndarray, upper: np.ndarray, include_last: bool):
+    """
+    Incremental version of create_window_graphs for sliding windows. A running table with the count of every
+    transition is kept while the window slides over the logs: the transitions that enter the window are added and
+    the ones that leave it are retracted, so the work per window is proportional to the slide instead of the size of
+    the window. The weights are normalized for every emitted window, same as in create_graph_as_dict.
+    The parameters are the same as in create_window_graphs, the windows should be sorted by their start.
+    """
+    # the i-th transition is (event_codes[i], event_codes[i + 1]), the last one of a window is dropped if needed
+    excluded = 1 if include_last else 2
+    codes = event_codes.tolist()
+    counts = {}
+    counted_lo, counted_hi = 0, 0
+    for lo, hi in zip(lower, upper):
+        lo, hi = int(lo), max(int(lo), int(hi) - excluded)
+        if lo >= counted_hi:
+            counts.clear()
+            counted_lo, counted_hi = lo, lo
+        for i in range(counted_hi, hi):
+            edge = (codes[i], codes[i + 1])
+            counts[edge] = counts.get(edge, 0) + 1
+        for i in range(counted_lo, lo):
+            edge = (codes[i], codes[i + 1])
+            if counts[edge] == 1:
+                del counts[edge]
+            else:
+                counts[edge] -= 1
+        counted_lo, counted_hi = lo, hi
+
+        edges = np.array(list(counts.keys()), dtype=np.int32).reshape(-1, 2)
+        yield TransitionGraph.from_counts(edges[:, 0], edges[:, 1], np.fromiter(counts.values(), dtype=np.int64))
+
+
+def create_window_graphs_in_parallel(window_graphs_function, event_codes: np.ndarray, lower: np.ndarray,
+                                     upper: np.ndarray, include_last: bool, workers: int):
+    """
+    Parallel version of create_window_graphs. The windows are split in contiguous chunks (a few per worker) and every
+    chunk is processed by a process in a pool. The event codes are placed in shared memory and every worker reads only
+    the range of logs covered by its chunk of windows, so overlapping sliding windows at the borders of the chunks are
+    handled by reading the shared logs twice. The graphs are yielded in the order of the windows.
+    :param window_graphs_function: module level function with the same signature as create_window_graphs
+    :param workers: the number of processes in the pool
+    """
+    chunks = [chunk for chunk in np.array_split(np.arange(len(lower)), 4 * workers) if len(chunk) > 0]
+    with SharedArray(event_codes) as shared_event_codes:
+        tasks = ((window_graphs_function, shared_event_codes, lower[chunk], upper[chunk], include_last)
+                 for chunk in chunks)
+        for graphs in map_in_process_pool(_create_window_graphs_chunk, tasks, workers):
+            yield from graphs
+
+
+def _create_window_graphs_chunk(window_graphs_function, shared_event_codes: SharedArray, lower: np.ndarray,
+                                upper: np.ndarray, include_last: bool) -> list:
+    offset = int(lower.min())
+    event_codes = shared_event_codes.read(offset, max(offset, int(upper.max())))
+    return list(window_graphs_function(event_codes, lower - offset, upper - offset, include_last))
+
+
+def create_session_transition_graphs(session_codes: np.ndarray, event_codes: np.ndarray, n_sessions: int,
+                                     include_last: bool) -> list:
+    """
+    Batched version of create_transition_graph that computes the graphs of all sessions at once. The events are
+    grouped by session with a stable sort, the event column is shifted by one inside the session groups to obtain the
+    (session, src, dst) transitions, which are then counted with a single groupby and normalized per session with a
+    grouped sum.
+    :param session_codes: array with the code (in the range [0, n_sessions)) of the session of every log
+    :param event_codes: array with the code of the event of every log, in the order of occurrence of the logs
+    :param n_sessions: the number of sessions
+    :param include_last: A bool value that represents whether the last event ID should be included in the graph generation
+    :return: list with the TransitionGraph of every session, indexed by the session code
+    """
+    order = np.argsort(session_codes, kind='stable')
+    sessions = np.asarray(session_codes)[order]
+    events = np.asarray(event_codes)[order]
+
+    # the i-th transition (events[i], events[i + 1]) is in the graph if the next (or the next two) logs are in the same
+    # session, the second condition drops the last transition of every session when include_last is False
+    valid = sessions[:-1] == sessions[1:]
+    if not include_last:
+        valid[:-1] &= sessions[:-2] == sessions[2:]
+        valid[-1:] = False
+    transitions = pd.DataFrame({
+        'session': sessions[:-1][valid],
+        'src': events[:-1][valid],
+        'dst': events[1:][valid]
+    })
+    counts = transitions.groupby(['session', 'src', 'dst'], sort=True).size()
+    weights = counts / counts.groupby(level='session').transform('sum')
+
+    edge_sessions = counts.index.get_level_values('session').to_numpy()
+    src = counts.index.get_level_values('src').to_numpy(dtype=np.int32)
+    dst = counts.index.get_level_values('dst').to_numpy(dtype=np.int32)
+    weights = weights.to_numpy(dtype=np.float64)
+    bounds = np.searchsorted(edge_sessions, np.arange(n_sessions + 1))
+    return [TransitionGraph(src[lo:hi], dst[lo:hi], weights[lo:hi]) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+def create_session_transition_graphs_in_parallel(session_codes: np.ndarray, session_ids: np.ndarray,
+                                                 event_codes: np.ndarray, include_last: bool, workers: int) -> list:
+    """
+    Parallel version of create_session_transition_graphs. The sessions are partitioned between the workers by the hash
+    of their session_id, the logs are grouped by partition (keeping their order inside the partition) and placed in
+    shared memory, from which every worker reads the contiguous range of its partition.
+    :param session_codes: array with the code of the session of every log, the codes are the positions in session_ids
+    :param session_ids: the unique session ids, in order of their first occurrence
+    :param event_codes: array with the code of the event of every log, in the order of occurrence of the logs
+    :param workers: the number of processes in the pool
+    :return: list with the TransitionGraph of every session, indexed by the session code
+    """
+    partitions = (pd.util.hash_array(np.asarray(session_ids, dtype=object)) % workers).astype(np.int64)
+    log_partitions = partitions[session_codes]
+    order = np.argsort(log_partitions, kind='stable')
+    bounds = np.searchsorted(log_partitions[order], np.arange(workers + 1))
+
+    graphs = [None] * len(session_ids)
+    with SharedArray(np.asarray(session_codes)[order]) as shared_session_codes, \
+            SharedArray(np.asarray(event_codes)[order]) as shared_event_codes:
+        tasks = ((shared_session_codes, shared_event_codes, lo, hi, include_last)
+                 for lo, hi in zip(bounds[:-1], bounds[1:]))
+        for partition_session_codes, partition_graphs in map_in_process_pool(_create_session_graphs_partition,
+                                                                             tasks, workers):
+            for session_code, graph in zip(partition_session_codes, partition_graphs):
+                graphs[session_code] = graph
+    return graphs
+
+
+def _create_session_graphs_partition(shared_session_codes: SharedArray, shared_event_codes: SharedArray, start: int,
+                                     stop: int, include_last: bool) -> tuple:
+    # the local codes follow the order of the first occurrence, same as the global ones
+    local_codes, session_codes = pd.factorize(shared_session_codes.read(start, stop))
+    graphs = create_session_transition_graphs(local_codes, shared_event_codes.read(start, stop), len(session_codes),
+                                              include_last=include_last)
+    return session_codes, graphs
+
+
 def create_graph_as_dict(event_ids: list, include_last: bool) -> dict:
     """
     Method that creates a graph represented as a dictionary based on the occurrences of event ids in a window/session
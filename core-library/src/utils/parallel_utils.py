@@ -0,0 +1,77 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+
+class SharedArray:
+    """
+    Class for a numpy array stored in shared memory, so that it can be passed to the worker processes of a pool without
+    being pickled for every task. Only the name of the shared memory block, the shape and the dtype of the array are
+    pickled, the workers read the part of the array they need with the read method.
+    The process that created the array is responsible to release the shared memory with unlink (or by using the object
+    as a context manager).
+    """
+
+    def __init__(self, array: np.ndarray):
+        array = np.ascontiguousarray(array)
+        self.shape = array.shape
+        self.dtype = array.dtype.str
+        self.memory = SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.name = self.memory.name
+        np.ndarray(self.shape, dtype=self.dtype, buffer=self.memory.buf)[...] = array
+
+    def __getstate__(self):
+        return {'name': self.name, 'shape': self.shape, 'dtype': self.dtype}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.unlink()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def read(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """
+        :return: private copy of the rows start:stop of the shared array
+        """
+        memory = SharedMemory(name=self.name)
+        try:
+            return np.ndarray(self.shape, dtype=self.dtype, buffer=memory.buf)[start:stop].copy()
+        finally:
+            memory.close()
+
+    def unlink(self):
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+
+
+def map_in_process_pool(function, tasks, workers: int, max_pending: int = None):
+    """
+    Method that runs the function for every task in a process pool and yields the results in the order of the tasks.
+    At most max_pending tasks (by default two per worker) are submitted ahead of the result that is currently yielded,
+    so the memory used by the results that wait to be consumed is bounded.
+    :param function: module level function, called as function(*task)
+    :param tasks: iterable of tuples with the arguments for every call of the function
+    :param workers: the number of processes in the pool
+    :param max_pending: the maximum number of submitted tasks whose results are not yielded yet
+    :return: generator of the results of the function
+    """
+    max_pending = max_pending or 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(function, *task))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+# Fields of the layouts of parse_fixed_width
+LAYOUT_FIELDS = {'Y': 'year', 'm': 'month', 'd': 'day', 'H': 'hour', 'M': 'minute', 'S': 'second', 'f': 'fraction'}
+DAYS_IN_MONTH = np.array([0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+def days_from_civil(year, month, day) -> np.ndarray:
+    """
+    Method that computes the number of days since 1970-01-01 of dates of the proleptic Gregorian calendar with integer
+    arithmetic (see http://howardhinnant.github.io/date_algorithms.html#days_from_civil)
+    :param year: int64 array with the years
+    :param month: int64 array with the months (1-12)
+    :param day: int64 array with the days of the month (1-31)
+    :return: int64 array with the days since the epoch
+    """
+    year = year - (month <= 2)
+    era = np.floor_divide(year, 400)
+    year_of_era = year - era * 400
+    day_of_year = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+def to_datetime64(year, month, day, hour=0, minute=0, second=0, nanosecond=0) -> np.ndarray:
+    """
+    Method that combines the fields of timestamps (int64 arrays or scalars) into a datetime64[ns] array, raising a
+    ValueError if a field is out of range
+    """
+    year, month, day, hour, minute, second, nanosecond = np.broadcast_arrays(
+        *[np.asarray(field, dtype=np.int64) for field in (year, month, day, hour, minute, second, nanosecond)])
+    valid_month = (month >= 1) & (month <= 12)
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    days_in_month = DAYS_IN_MONTH[np.where(valid_month, month, 0)] - ((month == 2) & ~leap)
+    invalid = ~valid_month | (day < 1) | (day > days_in_month) | (hour < 0) | (hour > 23) | (minute < 0) | \
+        (minute > 59) | (second < 0) | (second > 59)
+    if invalid.any():
+        i = np.flatnonzero(invalid)[0]
+        raise ValueError(f"Invalid timestamp {year[i]}-{month[i]}-{day[i]} {hour[i]}:{minute[i]}:{second[i]}")
+    seconds = days_from_civil(year, month, day) * 86400 + hour * 3600 + minute * 60 + second
+    if (np.abs(seconds) >= np.iinfo(np.int64).max // 1_000_000_000).any():
+        raise ValueError("Timestamp out of the range of datetime64[ns]")
+    return (seconds * 1_000_000_000 + nanosecond).astype('datetime64[ns]')
+
+
+def parse_fixed_width(values, layout: str, fallback_format: str = None) -> np.ndarray:
+    """
+    Method that parses timestamps with a fixed-width layout by reading the digits of the strings as a byte matrix,
+    without creating any intermediate string. If some value does not follow the layout, all values are parsed with
+    pd.to_datetime and fallback_format instead.
+    :param values: sequence of strings
+    :param layout: the layout of the timestamps, with one letter of LAYOUT_FIELDS for every digit of a field and the
+    separators as they appear in the strings, e.g. 'YYYY-mm-dd HH:MM:SS.ffffff'
+    :param fallback_format: the format of pd.to_datetime used for the values that do not follow the layout, None to
+    infer it
+    :return: datetime64[ns] array
+    """
+    width = len(layout)
+    values = pd.Series(values).to_numpy(dtype=object)
+    try:
+        # one more byte than the layout, which must be zero, to detect the longer strings
+        chars = values.astype(f'S{width + 1}').view(np.uint8).reshape(len(values), width + 1)
+    except (UnicodeEncodeError, TypeError, ValueError):
+        chars = None
+
+    if chars is not None and (chars[:, width] == 0).all():
+        digits = chars[:, :width].astype(np.int64) - ord('0')
+        fields = {}
+        follows_layout = True
+        for position, letter in enumerate(layout):
+            if letter in LAYOUT_FIELDS:
+                follows_layout &= bool(((digits[:, position] >= 0) & (digits[:, position] <= 9)).all())
+                fields.setdefault(LAYOUT_FIELDS[letter], []).append(position)
+            else:
+                follows_layout &= bool((chars[:, position] == ord(letter)).all())
+            if not follows_layout:
+                break
+
+        if follows_layout:
+            numbers = {}
+            for field, positions in fields.items():
+                numbers[field] = np.zeros(len(values), dtype=np.int64)
+                for position in positions:
+                    numbers[field] = numbers[field] * 10 + digits[:, position]
+            fraction_digits = len(fields.get('fraction', []))
+            nanosecond = numbers.pop('fraction', 0) * 10 ** (9 - fraction_digits)
+            return to_datetime64(nanosecond=nanosecond, **numbers)
+
+    return pd.to_datetime(values, format=fallback_format).to_numpy(dtype='datetime64[ns]')
+
+
+def parse_hdfs_timestamps(dates, times) -> np.ndarray:
+    """
+    Method that parses the timestamps of the HDFS logs, whose dates (yymmdd, e.g. 081109) and times (HHMMSS) are
+    read as integers
+    :return: datetime64[ns] array
+    """
+    dates = pd.to_numeric(pd.Series(dates)).to_numpy(dtype=np.int64)
+    times = pd.to_numeric(pd.Series(times)).to_numpy(dtype=np.int64)
+    return to_datetime64(2000 + dates // 10000, dates // 100 % 100, dates % 100,
+                         times // 10000, times // 100 % 100, times % 100)
@@ -1,7 +1,10 @@
 from __future__ import annotations
 
 from abc import abstractmethod, ABC
-from datetime import datetime, timedelta
+from datetime import datetime
+from typing import Iterator, Tuple
+
+import numpy as np
 import pandas as pd
 
 
@@ -25,16 +28,40 @@ class TimeWindowsCreator(WindowsCreator, ABC):
     def get_frequency(self) -> str:
         pass
 
+    @abstractmethod
+    def get_step(self) -> int:
+        """
+        :return: the distance between the starts of two consecutive windows in milliseconds
+        """
+        pass
+
+    def get_window_range(self) -> Tuple[int, int, int]:
+        """
+        Method that computes the windows arithmetically from the min and max timestamps: the windows start at
+        get_start plus every multiple of the step, as long as they start at least 1 millisecond before max_timestamp
+        :return: tuple (start of the first window, step, number of windows), with the start and the step in
+        nanoseconds
+        """
+        start = pd.Timestamp(self.get_start()).value
+        step = self.get_step() * 1_000_000
+        last = pd.Timestamp(self.max_timestamp).value - 1_000_000
+        count = (last - start) // step + 1 if last >= start else 0
+        return start, step, count
+
     def create_windows(self) -> pd.DataFrame:
-        start = self.get_start()
-        frequency = self.get_frequency()
-        windows = pd.date_range(start=start, end=datetime.now(), freq=frequency)
-        windows_df = pd.DataFrame(windows, columns=['start'])
-        windows_df = windows_df.drop(
-            windows_df[windows_df['start'] + timedelta(milliseconds=1) > self.max_timestamp].index
-        )
-        windows_df['end'] = windows_df.apply(lambda row: row['start'] + timedelta(milliseconds=self.size), axis=1)
-        return windows_df
+        start, step, count = self.get_window_range()
+        starts = (start + np.arange(count, dtype=np.int64) * step).astype('datetime64[ns]')
+        return pd.DataFrame({'start': starts, 'end': starts + np.timedelta64(self.size, 'ms')})
+
+    def iter_windows(self) -> Iterator[Tuple[pd.Timestamp, pd.Timestamp]]:
+        """
+        Lazy version of create_windows that yields the start and the end of one window at a time
+        """
+        start, step, count = self.get_window_range()
+        size = pd.Timedelta(milliseconds=self.size)
+        for i in range(count):
+            window_start = pd.Timestamp(start + i * step)
+            yield window_start, window_start + size
 
 
 class TumblingWindowCreator(TimeWindowsCreator):
@@ -48,6 +75,9 @@ class TumblingWindowCreator(TimeWindowsCreator):
     def get_frequency(self) -> str:
         return f"{self.size}L"
 
+    def get_step(self) -> int:
+        return self.size
+
 
 class SlidingWindowCreator(TimeWindowsCreator):
     def __init__(self, min_timestamp: datetime, max_timestamp: datetime, size: int, slide: int):
@@ -61,6 +91,9 @@ class SlidingWindowCreator(TimeWindowsCreator):
     def get_frequency(self) -> str:
         return f"{self.slide}L"
 
+    def get_step(self) -> int:
+        return self.slide
+
 
 class SessionWindowCreator(WindowsCreator):
     def __init__(self, logs: pd.DataFrame):
@@ -87,18 +120,12 @@ def generate_time_windows(wtype, size, slide, min_logs_timestamp, max_logs_times
     :return:
     windows_df (pandas DataFrame): A dataframe with two columns: 'start' and 'end' of the time windows
     """
-    frequency = f"{size}L" if wtype == 'tumbling' else f"{slide}L"
     if wtype == "tumbling":
-        start = int(int(min_logs_timestamp.timestamp() * 1000) / size) * size
+        windows_creator = TumblingWindowCreator(min_logs_timestamp, max_logs_timestamp, size)
     else:
-        start = int(int(min_logs_timestamp.timestamp() * 1000 - size + slide) / slide) * slide
-    start = datetime.utcfromtimestamp(int(start / 1000))
-    print(start)
-    windows = pd.date_range(start=start, end=datetime.now(), freq=frequency)
-    windows_df = pd.DataFrame(windows, columns=['start'])
-    windows_df = windows_df.drop(windows_df[windows_df['start'] + timedelta(milliseconds=1) > max_logs_timestamp].index)
-    windows_df['end'] = windows_df.apply(lambda row: row['start'] + timedelta(milliseconds=size), axis=1)
-    return windows_df
+        windows_creator = SlidingWindowCreator(min_logs_timestamp, max_logs_timestamp, size, slide)
+    print(windows_creator.get_start())
+    return windows_creator.create_windows()
 
 
 def generate_session_windows(logs: pd.DataFrame) -> pd.DataFrame: